@@ -16,6 +16,8 @@ from fetch.shiphero import (
 from fetch.shopify import (
     fetch_shopify_sales_data,
     fetch_shopify_inventory_data,
+    fetch_shopify_committed_inventory,
+    clear_sales_store,
 )
 
 __all__ = [
@@ -25,4 +27,6 @@ __all__ = [
     'fetch_purchase_orders_from_shiphero',
     'fetch_shopify_sales_data',
     'fetch_shopify_inventory_data',
+    'fetch_shopify_committed_inventory',
+    'clear_sales_store',
 ]
@@ -3,9 +3,14 @@ from urllib.parse import urlencode
 from config import AIRTABLE_API_KEY, AIRTABLE_VARIANTS_ENDPOINT, AIRTABLE_PRODUCTION_DEV_BASE_ID
 import pandas as pd
 from pyairtable import Table
+from utils.cache import cached_fetch
 
+# Line items of open and draft POs that make up the incoming stock
+INCOMING_STOCK_FORMULA = "OR({PO Status} = 'Open', {PO Status} = 'Draft')"
+INCOMING_STOCK_FIELDS = ['Position - PO # - SKU', 'sku', 'Quantity Ordered', 'Quantity Received']
 
-def fetch_airtable_incoming_stock():
+
+def fetch_airtable_incoming_stock(use_cache=False, cache_policy=None):
     """
     Fetches incoming stock data from Airtable and processes it into a pandas DataFrame.
     This function retrieves records from the "Line Items" table in Airtable where the 
@@ -16,13 +21,21 @@ def fetch_airtable_incoming_stock():
       pandas.DataFrame: A DataFrame containing the SKU and the summed incoming stock for each SKU.
     """
 
+    return cached_fetch(
+        "airtable_incoming_stock", fetch_fresh_airtable_incoming_stock,
+        {"formula": INCOMING_STOCK_FORMULA, "fields": INCOMING_STOCK_FIELDS}, use_cache, cache_policy
+    )
+
+def fetch_fresh_airtable_incoming_stock():
+    """Fetch and group the incoming stock from Airtable, bypassing the cache."""
+
     print("Fetching incoming stock data from Airtable...")
     
     # print("Initializing Airtable table...")
     line_items_table = Table(AIRTABLE_API_KEY, AIRTABLE_PRODUCTION_DEV_BASE_ID, "Line Items")
 
     # print("Fetching records with PO Status = 'Open'...")
-    records = line_items_table.all(formula="OR({PO Status} = 'Open', {PO Status} = 'Draft')", fields=['Position - PO # - SKU', 'sku', 'Quantity Ordered', 'Quantity Received'])
+    records = line_items_table.all(formula=INCOMING_STOCK_FORMULA, fields=INCOMING_STOCK_FIELDS)
     # print(f"Fetched {len(records)} records.")
     # print("First 5 records:")
     # for record in records[:5]:
@@ -60,7 +73,7 @@ def fetch_airtable_incoming_stock():
 
     return grouped_df
 
-def fetch_airtable_product_metadata():
+def fetch_airtable_product_metadata(use_cache=False, cache_policy=None):
     """
     Fetches product metadata from Airtable and processes it into a pandas DataFrame.
     This function retrieves records from the "Variants" table in Airtable and extracts
@@ -98,6 +111,15 @@ def fetch_airtable_product_metadata():
         ]
     }
     
+    # A failed fetch returns None, which is not cached
+    return cached_fetch(
+        "airtable_product_metadata", lambda: fetch_fresh_airtable_product_metadata(headers, params),
+        params, use_cache, cache_policy
+    )
+
+def fetch_fresh_airtable_product_metadata(headers, params):
+    """Page through the Airtable Variants view, bypassing the cache. Returns None on failure."""
+    params = dict(params)
     all_records = []
     offset = None
 
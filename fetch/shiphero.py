@@ -1,32 +1,129 @@
-import os
-import pickle
+import re
+import pandas as pd
 from config import SHIPHERO_WAREHOUSE_ID
-from datetime import datetime
-from utils import fetch_shiphero_paginated_data
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
+from utils import fetch_shiphero_paginated_data, fetch_shiphero_with_throttling, fetch_shiphero_inventory_snapshot, iter_inventory_snapshot_nodes, parse_stock_levels
+from utils.shiphero import SHIPHERO_WAREHOUSE_IDS, ShipHeroAPIError
+from utils.cache import cache_lock, read_cache, write_cache
+from utils.state import load_state, save_state
 
+# Line items fetched per purchase order with the PO; longer POs are paged with PO_LINE_ITEMS_QUERY
+PO_LINE_ITEMS_PAGE_SIZE = 50
 
-def fetch_shiphero_stock_levels(use_cache=False):
+PO_LINE_ITEMS_QUERY = """
+query ($id: String!, $first: Int!, $after: String) {
+  purchase_order(id: $id) {
+    complexity
+    request_id
+    data {
+      line_items(first: $first, after: $after) {
+        pageInfo {
+          hasNextPage
+          endCursor
+        }
+        edges {
+          node {
+            id
+            sku
+            quantity
+            quantity_received
+          }
+        }
+      }
+    }
+  }
+}
+"""
+
+# Ways fetch_shiphero_stock_levels can read a warehouse's stock levels
+STOCK_LEVELS_MODES = ("paginated", "snapshot", "delta")
+
+# Overlap applied to the delta sync watermark to absorb clock skew and in-flight updates
+STOCK_LEVELS_WATERMARK_OVERLAP = timedelta(minutes=5)
+
+
+def fetch_shiphero_stock_levels(use_cache=False, mode="paginated", warehouse_ids=None, cache_policy=None):
     """
-    Fetches stock levels data from ShipHero and processes it into a list of dictionaries.
+    Fetches stock levels data from ShipHero and processes it into a pandas DataFrame.
     This function retrieves stock levels data from the ShipHero GraphQL API and paginates
-    through the results to fetch all available data. It then processes the data into a list
-    of dictionaries, where each dictionary represents a product and contains relevant fields.
+    through the results to fetch all available data. It then processes the data into a typed
+    table with one row per product and warehouse.
+    With mode="snapshot" the data is instead read from a ShipHero inventory snapshot, which
+    is generated asynchronously and downloaded as a single file; this is much cheaper than
+    paginating warehouse_products for large warehouses.
+    With mode="delta" only the warehouse products updated since the last sync are fetched
+    and patched into the cached stock levels. The first delta run (or one without a stored
+    watermark) falls back to a full paginated fetch.
+    Each warehouse in warehouse_ids (default: SHIPHERO_WAREHOUSE_IDS) is fetched in parallel
+    with its own "shiphero_stock_levels" cache entry, checkpoint and watermark. With a
+    cache_policy, each warehouse's cache is reused while it is fresh enough for that source.
     Returns:
-      list: A list of dictionaries containing the stock levels data for each product.
+      pandas.DataFrame: sku, on_hand, allocated, available and backorder (int64) per product,
+      with the warehouse it is stocked in as warehouse_id.
     """
-    
-    CACHE_FILE = 'cache/shiphero_stock_levels.pkl'
 
-    if use_cache and os.path.exists(CACHE_FILE):
-        print("Loading cached stock levels data...")
-        with open(CACHE_FILE, 'rb') as f:
-          return pickle.load(f)
-        
-    print("Fetching fresh stock levels data from ShipHero...")
+    if mode not in STOCK_LEVELS_MODES:
+        raise ValueError(f"Unknown stock levels fetch mode: {mode}")
+
+    warehouse_ids = warehouse_ids or SHIPHERO_WAREHOUSE_IDS
+    with ThreadPoolExecutor(max_workers=len(warehouse_ids)) as executor:
+        warehouse_stock_levels = list(executor.map(
+            lambda warehouse_id: fetch_shiphero_warehouse_stock_levels(warehouse_id, use_cache, mode, cache_policy),
+            warehouse_ids
+        ))
+
+    return pd.concat([
+        stock_levels.assign(warehouse_id=warehouse_id)
+        for warehouse_id, stock_levels in zip(warehouse_ids, warehouse_stock_levels)
+    ], ignore_index=True)
+
+def warehouse_file_key(warehouse_id):
+    """File-name-safe key for a warehouse's snapshot, checkpoint and watermark names."""
+    return re.sub(r"[^A-Za-z0-9]", "", warehouse_id)
+
+def fetch_shiphero_warehouse_stock_levels(warehouse_id, use_cache=False, mode="paginated", cache_policy=None):
+    """
+    Fetch (or load from cache) the stock levels of a single warehouse. The warehouse's cache
+    entry is locked while fetching, so concurrent jobs wait for one fetch instead of repeating it.
+    """
+
+    with cache_lock("shiphero_stock_levels", {"warehouse_id": warehouse_id}):
+        stock_levels = read_cache("shiphero_stock_levels", {"warehouse_id": warehouse_id}, use_cache, cache_policy)
+        if stock_levels is not None:
+            print(f"Loading cached stock levels data for warehouse {warehouse_id}...")
+            return stock_levels
+        return fetch_fresh_warehouse_stock_levels(warehouse_id, mode)
+
+def fetch_fresh_warehouse_stock_levels(warehouse_id, mode):
+    """Fetch a single warehouse's stock levels from ShipHero and cache them."""
+
+    key = warehouse_file_key(warehouse_id)
+    SNAPSHOT_FILE = f'cache/shiphero_inventory_snapshot_{key}.json'
+
+    # Recorded before fetching so updates made while the fetch runs are picked up by the next delta
+    sync_started_at = datetime.now(timezone.utc)
+
+    if mode == "delta":
+        stock_levels = fetch_shiphero_stock_level_changes(warehouse_id)
+        if stock_levels is not None:
+            save_stock_levels_cache(warehouse_id, stock_levels, sync_started_at)
+            return stock_levels
+        print(f"No stock levels watermark found for warehouse {warehouse_id}, falling back to a full fetch...")
+        mode = "paginated"
+
+    if mode == "snapshot":
+        print(f"Fetching fresh stock levels data for warehouse {warehouse_id} from a ShipHero inventory snapshot...")
+        snapshot_path = fetch_shiphero_inventory_snapshot(warehouse_id, SNAPSHOT_FILE)
+        stock_levels = parse_stock_levels(iter_inventory_snapshot_nodes(snapshot_path))
+        save_stock_levels_cache(warehouse_id, stock_levels, sync_started_at)
+        return stock_levels
+
+    print(f"Fetching fresh stock levels data for warehouse {warehouse_id} from ShipHero...")
 
     query = """
-    query ($first: Int!, $after: String) {
-      warehouse_products(warehouse_id: "V2FyZWhvdXNlOjEwMTU4Mw==", active: true) { 
+    query ($first: Int!, $after: String, $warehouse_id: String) {
+      warehouse_products(warehouse_id: $warehouse_id, active: true) { 
         complexity 
         request_id 
         data(first: $first, after: $after) { 
@@ -49,20 +146,91 @@ def fetch_shiphero_stock_levels(use_cache=False):
     }
     """
     
+    # Initial page size; later pages are sized from the complexity ShipHero reports
     variables = {
         "first": 100,
-        "after": None
+        "after": None,
+        "warehouse_id": warehouse_id
     }
     
-    stock_levels = fetch_shiphero_paginated_data(query, variables, "warehouse_products")
+    stock_levels = parse_stock_levels(fetch_shiphero_paginated_data(query, variables, "warehouse_products", checkpoint_name=f"shiphero_stock_levels_{key}"))
 
-    # Save the fetched data to cache
-    os.makedirs(os.path.dirname(CACHE_FILE), exist_ok=True)
-    with open(CACHE_FILE, 'wb') as f:
-      pickle.dump(stock_levels, f)
+    save_stock_levels_cache(warehouse_id, stock_levels, sync_started_at)
         
     return stock_levels
 
+def fetch_shiphero_stock_level_changes(warehouse_id):
+    """
+    Patch a warehouse's cached stock levels with the warehouse products updated since its stored watermark.
+    Returns None when there is no cached table or watermark to patch.
+    """
+    key = warehouse_file_key(warehouse_id)
+    watermark = load_state(f"shiphero_stock_levels_watermark_{key}")
+    if not watermark or watermark.get("warehouse_id") != warehouse_id:
+        return None
+    cached_stock_levels = read_cache("shiphero_stock_levels", {"warehouse_id": warehouse_id}, use_cache=True)
+    if cached_stock_levels is None:
+        return None
+
+    updated_from = datetime.fromisoformat(watermark["synced_at"]) - STOCK_LEVELS_WATERMARK_OVERLAP
+    print(f"Fetching stock level changes for warehouse {warehouse_id} from ShipHero since {updated_from.isoformat()}...")
+
+    # No active filter: products deactivated since the last sync must be removed from the table
+    query = """
+    query ($first: Int!, $after: String, $warehouse_id: String, $updated_from: ISODateTime) {
+      warehouse_products(warehouse_id: $warehouse_id, updated_from: $updated_from) {
+        complexity
+        request_id
+        data(first: $first, after: $after) {
+          pageInfo {
+            hasNextPage
+            endCursor
+          }
+          edges {
+            node {
+              id
+              sku
+              active
+              on_hand
+              allocated
+              available
+              backorder
+            }
+          }
+        }
+      }
+    }
+    """
+
+    variables = {
+        "first": 100,
+        "after": None,
+        "warehouse_id": warehouse_id,
+        # Explicit UTC offset, so the watermark is not read in the account's local time zone
+        "updated_from": updated_from.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S+00:00")
+    }
+
+    changes = fetch_shiphero_paginated_data(query, variables, "warehouse_products", checkpoint_name=f"shiphero_stock_level_changes_{key}")
+
+    # Changed products replace their cached rows; deactivated ones are dropped
+    changed_skus = [product["node"]["sku"] for product in changes]
+    active_changes = parse_stock_levels([product for product in changes if product["node"].get("active", True)])
+    stock_levels = pd.concat([
+        cached_stock_levels[~cached_stock_levels["sku"].isin(changed_skus)],
+        active_changes
+    ], ignore_index=True)
+
+    print(f"Patched {len(changes)} changed products into {len(stock_levels)} cached stock levels")
+    return stock_levels
+
+def save_stock_levels_cache(warehouse_id, stock_levels, synced_at):
+    """Save a warehouse's fetched stock levels to the cache and advance its delta sync watermark."""
+    write_cache("shiphero_stock_levels", stock_levels, {"warehouse_id": warehouse_id})
+    save_state(f"shiphero_stock_levels_watermark_{warehouse_file_key(warehouse_id)}", {
+        "warehouse_id": warehouse_id,
+        "synced_at": synced_at.isoformat()
+    })
+
 def fetch_purchase_orders_from_shiphero(created_from: str = None):
   """Fetch active purchase orders from ShipHero."""
   
@@ -77,7 +245,7 @@ def fetch_purchase_orders_from_shiphero(created_from: str = None):
     raise ValueError(f"Invalid date format for 'created_from': {created_from}. Expected format: YYYY-MM-DD") from e
 
   query = """
-  query ($first: Int!, $after: String, $created_from: ISODateTime, $warehouse_id: String){
+  query ($first: Int!, $after: String, $created_from: ISODateTime, $warehouse_id: String, $line_items_first: Int){
     purchase_orders(created_from: $created_from, warehouse_id: $warehouse_id) {
       complexity
       request_id
@@ -91,7 +259,11 @@ def fetch_purchase_orders_from_shiphero(created_from: str = None):
             id
             po_number
             fulfillment_status
-            line_items {
+            line_items(first: $line_items_first) {
+              pageInfo {
+                hasNextPage
+                endCursor
+              }
               edges {
                 node {
                   id
@@ -108,16 +280,39 @@ def fetch_purchase_orders_from_shiphero(created_from: str = None):
   }
   """
   
+  # Page size is only the starting point; fetch_shiphero_paginated_data grows it from the observed complexity.
+  # Capping the nested line_items connection keeps the per-PO complexity (and so the page cost) small.
   variables = {
     "first": 10,
     "after": None,
     "created_from": created_from,
-    "warehouse_id": SHIPHERO_WAREHOUSE_ID
+    "warehouse_id": SHIPHERO_WAREHOUSE_ID,
+    "line_items_first": PO_LINE_ITEMS_PAGE_SIZE
   }
 
   # print the query and variables
   print(query)
   print(variables)
-  purchase_orders = fetch_shiphero_paginated_data(query, variables, "purchase_orders")
+  purchase_orders = fetch_shiphero_paginated_data(query, variables, "purchase_orders", checkpoint_name="shiphero_purchase_orders")
+
+  for purchase_order in purchase_orders:
+    if purchase_order["node"]["line_items"]["pageInfo"]["hasNextPage"]:
+      fetch_remaining_po_line_items(purchase_order["node"])
   
   return purchase_orders
+
+def fetch_remaining_po_line_items(purchase_order):
+  """
+  Page the line items of a purchase order beyond the first PO_LINE_ITEMS_PAGE_SIZE into its
+  line_items connection, so no PO is returned with part of its line items.
+  """
+  line_items = purchase_order["line_items"]
+  print(f"Fetching the remaining line items of purchase order {purchase_order['po_number']}...")
+  while line_items["pageInfo"]["hasNextPage"]:
+    variables = {"id": purchase_order["id"], "first": PO_LINE_ITEMS_PAGE_SIZE, "after": line_items["pageInfo"]["endCursor"]}
+    result = fetch_shiphero_with_throttling(PO_LINE_ITEMS_QUERY, variables) or {}
+    page = (((result.get("data") or {}).get("purchase_order") or {}).get("data") or {}).get("line_items")
+    if not page:
+      raise ShipHeroAPIError(f"Failed to fetch the line items of purchase order {purchase_order['po_number']}: {result.get('errors')}")
+    line_items["edges"].extend(page["edges"])
+    line_items["pageInfo"] = page["pageInfo"]
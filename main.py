@@ -3,15 +3,26 @@ import threading
 from workflows import prepare_replenishment
 from export import populate_production
 from workflows import push_pos_to_shiphero, sync_shiphero_purchase_orders_to_airtable
+from fetch import clear_sales_store
+from fetch.shiphero import STOCK_LEVELS_MODES
 from documents import packing_slips, barcode_labels
+from utils.shopify import notify_bulk_operation_finished, verify_shopify_webhook
+from utils.cache import CachePolicy, invalidate_cache, is_cache_source
 
 app = Flask(__name__)
 
 @app.route('/webhook/prepare_replenishment', methods=['GET', 'POST'])
 def webhook_prepare_replenishment():
     use_cache_stock_levels = request.args.get('use_cache_stock_levels', 'false').lower() == 'true'
-    use_cache_sales = request.args.get('use_cache_sales', 'false').lower() == 'true'
-    threading.Thread(target=prepare_replenishment, args=(use_cache_stock_levels, use_cache_sales)).start()
+    use_cache_sales = request.args.get('use_cache_sales', 'true').lower() == 'true'
+    stock_levels_mode = request.args.get('stock_levels_mode', 'paginated').lower()
+    if stock_levels_mode not in STOCK_LEVELS_MODES:
+        return jsonify({"status": "Invalid stock_levels_mode"}), 400
+    try:
+        cache_policy = CachePolicy.from_args(request.args)
+    except ValueError:
+        return jsonify({"status": "Invalid cache parameters"}), 400
+    threading.Thread(target=prepare_replenishment, args=(use_cache_stock_levels, use_cache_sales, stock_levels_mode, cache_policy)).start()
     return jsonify({"status": "Task prepare_replenishment started"}), 200
 
 @app.route('/webhook/populate_production', methods=['GET', 'POST'])
@@ -40,6 +51,30 @@ def webhook_sync_shiphero_purchase_orders_to_airtable():
     threading.Thread(target=sync_shiphero_purchase_orders_to_airtable, args=(created_from,)).start()
     return jsonify({"status": "Task sync_shiphero_purchase_orders_to_airtable started"}), 200
 
+@app.route('/webhook/invalidate_cache', methods=['GET', 'POST'])
+def webhook_invalidate_cache():
+    # Without a source every cached fetch result is removed
+    source = request.args.get('source') or request.form.get('source')
+    if source and not is_cache_source(source):
+        return jsonify({"status": "Invalid cache source"}), 400
+    if source == "shopify_sales":
+        # Sales live in the sales store rather than in cache entries
+        threading.Thread(target=clear_sales_store).start()
+    else:
+        threading.Thread(target=invalidate_cache, args=(source,)).start()
+    return jsonify({"status": "Task invalidate_cache started"}), 200
+
+@app.route('/webhook/shopify/bulk_operations_finish', methods=['POST'])
+def webhook_shopify_bulk_operations_finish():
+    # Shopify calls this when a bulk operation finishes; wake the fetch waiting on it
+    if not verify_shopify_webhook(request.get_data(), request.headers.get('X-Shopify-Hmac-Sha256')):
+        return jsonify({"status": "Invalid webhook signature"}), 401
+    payload = request.get_json(silent=True) or {}
+    bulk_operation_id = payload.get('admin_graphql_api_id')
+    if bulk_operation_id:
+        notify_bulk_operation_finished(bulk_operation_id)
+    return jsonify({"status": "Bulk operation finish received"}), 200
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -0,0 +1,86 @@
+import sys
+import os
+import hmac
+import json
+import time
+import base64
+import hashlib
+import threading
+
+# Add the project directory to the Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import utils.shopify
+from utils.shopify import wait_for_bulk_operation
+from main import app
+
+BULK_OPERATION_ID = "gid://shopify/BulkOperation/1234"
+WEBHOOK_SECRET = "test-webhook-secret"
+
+
+def post_webhook(payload, secret=WEBHOOK_SECRET):
+    """Post a bulk_operations/finish payload signed with secret, as Shopify does."""
+    body = json.dumps(payload).encode()
+    signature = base64.b64encode(hmac.new(secret.encode(), body, hashlib.sha256).digest()).decode()
+    return app.test_client().post('/webhook/shopify/bulk_operations_finish', data=body,
+                                  content_type='application/json', headers={'X-Shopify-Hmac-Sha256': signature})
+
+
+def test_finish_webhook_wakes_waiting_fetch():
+    """A bulk_operations/finish webhook ends the wait without sitting out the poll interval."""
+    finished = threading.Event()
+
+    def fake_get_bulk_operation(bulk_operation_id):
+        status = "COMPLETED" if finished.is_set() else "RUNNING"
+        return {"id": bulk_operation_id, "status": status, "objectCount": "10"}
+
+    original_get_bulk_operation = utils.shopify.get_bulk_operation
+    original_secret = getattr(utils.shopify.config, "SHOPIFY_WEBHOOK_SECRET", None)
+    utils.shopify.get_bulk_operation = fake_get_bulk_operation
+    utils.shopify.config.SHOPIFY_WEBHOOK_SECRET = WEBHOOK_SECRET
+    try:
+        results = []
+        waiter = threading.Thread(target=lambda: results.append(wait_for_bulk_operation(
+            {"id": BULK_OPERATION_ID, "status": "RUNNING", "objectCount": "0"},
+            min_interval=30, max_interval=30
+        )))
+        start = time.monotonic()
+        waiter.start()
+        while BULK_OPERATION_ID not in utils.shopify._bulk_operation_events:
+            time.sleep(0.01)
+
+        # Local stand-in for Shopify delivering the webhook
+        finished.set()
+        payload = {
+            "admin_graphql_api_id": BULK_OPERATION_ID,
+            "completed_at": "2024-01-01T00:00:00-05:00",
+            "created_at": "2024-01-01T00:00:00-05:00",
+            "error_code": None,
+            "status": "completed",
+            "type": "query"
+        }
+        assert post_webhook(payload, secret="wrong-secret").status_code == 401
+        assert post_webhook(payload).status_code == 200
+
+        waiter.join(timeout=10)
+        assert not waiter.is_alive()
+        assert results[0]["status"] == "COMPLETED"
+        assert time.monotonic() - start < 10
+        assert BULK_OPERATION_ID not in utils.shopify._bulk_operation_events
+        print("✓ Webhook woke the waiting fetch immediately")
+
+        # Notifications for operations nobody waits on leave no event behind
+        assert post_webhook(dict(payload, admin_graphql_api_id="gid://shopify/BulkOperation/5678")).status_code == 200
+        assert "gid://shopify/BulkOperation/5678" not in utils.shopify._bulk_operation_events
+
+        # Without a configured secret every request is rejected
+        utils.shopify.config.SHOPIFY_WEBHOOK_SECRET = None
+        assert post_webhook(payload).status_code == 401
+        print("✓ Webhooks are rejected unless signed with the configured secret")
+    finally:
+        utils.shopify.get_bulk_operation = original_get_bulk_operation
+        utils.shopify.config.SHOPIFY_WEBHOOK_SECRET = original_secret
+
+
+if __name__ == "__main__":
+    test_finish_webhook_wakes_waiting_fetch()
@@ -0,0 +1,130 @@
+import sys
+import os
+import json
+import time
+import tempfile
+import threading
+import pandas as pd
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+# Add the project directory to the Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import utils.cache as cache
+from utils.cache import CachePolicy, cached_fetch, read_cache, write_cache, invalidate_cache, cache_entry_path
+
+
+@contextmanager
+def temporary_cache_dir():
+    """Point the cache layer at a temporary directory for the duration of a test."""
+    original = cache.CACHE_DIR
+    with tempfile.TemporaryDirectory() as directory:
+        cache.CACHE_DIR = directory
+        try:
+            yield
+        finally:
+            cache.CACHE_DIR = original
+
+
+def test_entries_keyed_by_source_and_query():
+    with temporary_cache_dir():
+        write_cache("shopify_committed_inventory", ["a"], {"location_ids": ["1"]})
+        write_cache("shopify_committed_inventory", ["b"], {"location_ids": ["2"]})
+
+        assert read_cache("shopify_committed_inventory", {"location_ids": ["1"]}, use_cache=True) == ["a"]
+        assert read_cache("shopify_committed_inventory", {"location_ids": ["2"]}, use_cache=True) == ["b"]
+        assert read_cache("shopify_committed_inventory", {"location_ids": ["3"]}, use_cache=True) is None
+        assert read_cache("shopify_committed_inventory", {"location_ids": ["1"]}) is None
+        assert os.path.exists(cache_entry_path("shopify_committed_inventory", {"location_ids": ["1"]}, ".json"))
+
+        # Stale entries are refetched under a policy
+        metadata_path = cache_entry_path("shopify_committed_inventory", {"location_ids": ["1"]}, ".json")
+        with open(metadata_path) as file:
+            metadata = json.load(file)
+        metadata["cached_at"] = (datetime.now(timezone.utc) - timedelta(hours=1)).isoformat()
+        with open(metadata_path, "w") as file:
+            json.dump(metadata, file)
+        policy = CachePolicy({"shopify_committed_inventory": timedelta(minutes=5)})
+        assert read_cache("shopify_committed_inventory", {"location_ids": ["1"]}, cache_policy=policy) is None
+        assert read_cache("shopify_committed_inventory", {"location_ids": ["2"]}, cache_policy=policy) == ["b"]
+
+        try:
+            cache_entry_path("../state")
+            assert False, "invalid source accepted"
+        except ValueError:
+            pass
+    print("✓ Cache entries are keyed by source and query and expire by TTL")
+
+
+def test_concurrent_fetches_share_one_result():
+    with temporary_cache_dir():
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            time.sleep(0.2)
+            return {"rows": 1}
+
+        policy = CachePolicy()
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(cached_fetch("airtable_incoming_stock", fetch, "q", cache_policy=policy)))
+            for _ in range(3)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(calls) == 1
+        assert results == [{"rows": 1}] * 3
+
+        # Failed fetches are not cached
+        assert cached_fetch("airtable_product_metadata", lambda: None, "q", use_cache=True) is None
+        assert not os.path.exists(cache_entry_path("airtable_product_metadata", "q"))
+    print("✓ Concurrent fetches of one entry wait for and reuse a single fetch")
+
+
+def test_invalidate_cache():
+    with temporary_cache_dir():
+        write_cache("shopify_inventory", 1, "q1")
+        write_cache("shopify_inventory", 2, "q2")
+        write_cache("airtable_incoming_stock", 3, "q")
+
+        assert invalidate_cache("shopify_inventory", "q1") == 1
+        assert read_cache("shopify_inventory", "q1", use_cache=True) is None
+        assert read_cache("shopify_inventory", "q2", use_cache=True) == 2
+        assert invalidate_cache("shopify_inventory") == 1
+        assert invalidate_cache() == 1
+        assert read_cache("airtable_incoming_stock", "q", use_cache=True) is None
+    print("✓ invalidate_cache removes one entry, one source or everything")
+
+
+def test_dataframes_cached_as_arrow():
+    with temporary_cache_dir():
+        stock_levels = pd.DataFrame({
+            "sku": ["SKU-001", "SKU-002"],
+            "on_hand": pd.Series([10, 2], dtype="int64"),
+            "warehouse_id": ["V2FyZWhvdXNlOjEwMTU4Mw==", None],
+        })
+        write_cache("shiphero_stock_levels", stock_levels, {"warehouse_id": "1"})
+
+        assert os.path.exists(cache_entry_path("shiphero_stock_levels", {"warehouse_id": "1"}, ".arrow"))
+        assert not os.path.exists(cache_entry_path("shiphero_stock_levels", {"warehouse_id": "1"}, ".pkl"))
+        pd.testing.assert_frame_equal(read_cache("shiphero_stock_levels", {"warehouse_id": "1"}, use_cache=True), stock_levels)
+
+        # Entries from an older cache format are refetched rather than misread
+        cache.CACHE_FORMAT_VERSION += 1
+        try:
+            assert read_cache("shiphero_stock_levels", {"warehouse_id": "1"}, use_cache=True) is None
+        finally:
+            cache.CACHE_FORMAT_VERSION -= 1
+    print("✓ DataFrames are cached as Arrow IPC files and read back with their dtypes")
+
+
+if __name__ == "__main__":
+    test_entries_keyed_by_source_and_query()
+    test_concurrent_fetches_share_one_result()
+    test_invalidate_cache()
+    test_dataframes_cached_as_arrow()
@@ -0,0 +1,47 @@
+import sys
+import os
+import time
+from datetime import timedelta
+
+# Add the project directory to the Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.cache import CachePolicy, should_use_cache, DEFAULT_CACHE_TTLS
+
+
+def test_from_args():
+    assert CachePolicy.from_args({"use_cache_sales": "true"}) is None
+
+    policy = CachePolicy.from_args({"cache": "ttl"})
+    assert policy.allowed_age("shopify_sales") == DEFAULT_CACHE_TTLS["shopify_sales"]
+
+    policy = CachePolicy.from_args({
+        "cache_ttl_shopify_sales": "3600",
+        "cache_max_age": "1800",
+        "refresh": "shiphero_stock_levels",
+    })
+    assert policy.allowed_age("shopify_sales") == timedelta(seconds=1800)
+    assert policy.allowed_age("airtable_incoming_stock") == DEFAULT_CACHE_TTLS["airtable_incoming_stock"]
+    assert policy.allowed_age("shiphero_stock_levels") == timedelta(0)
+    assert policy.allowed_age("unknown_source") == timedelta(0)
+    print("✓ CachePolicy.from_args parses TTLs, max age and refresh")
+
+
+def test_should_use_cache():
+    policy = CachePolicy({"shopify_inventory": timedelta(minutes=10)})
+    assert not should_use_cache("shopify_inventory", None, True, policy)
+    assert not should_use_cache("shopify_inventory", None, True, None)
+
+    now = time.time()
+    assert should_use_cache("shopify_inventory", now, False, policy)
+    assert not should_use_cache("shopify_inventory", now, False, None)
+    assert should_use_cache("shopify_inventory", now, True, None)
+
+    stale = now - 3600
+    assert not should_use_cache("shopify_inventory", stale, True, policy)
+    assert should_use_cache("shopify_inventory", stale, True, None)
+    print("✓ should_use_cache follows the policy's TTL, or use_cache without one")
+
+if __name__ == "__main__":
+    test_from_args()
+    test_should_use_cache()
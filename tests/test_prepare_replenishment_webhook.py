@@ -0,0 +1,19 @@
+import sys
+import os
+
+# Add the project directory to the Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from main import app
+
+
+def test_invalid_parameters_are_rejected():
+    """Bad parameters get a 400 before the background task starts."""
+    client = app.test_client()
+    assert client.get('/webhook/prepare_replenishment?stock_levels_mode=bogus').status_code == 400
+    assert client.get('/webhook/prepare_replenishment?cache_max_age=soon').status_code == 400
+    print("✓ Unknown stock levels modes and cache parameters are rejected")
+
+
+if __name__ == "__main__":
+    test_invalid_parameters_are_rejected()
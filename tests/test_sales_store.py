@@ -0,0 +1,237 @@
+import sys
+import os
+import tempfile
+from datetime import datetime, timedelta, timezone
+
+# Add the project directory to the Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.sales_store import SalesStore
+from utils.shopify import parse_bulk_orders
+import utils.cache
+import utils.shopify
+import fetch.shopify
+from utils.shopify import find_reusable_bulk_operation
+from fetch.shopify import qualifying_orders
+from utils.cache import CachePolicy
+
+
+def order_records(order_number, created_at, quantities, fulfillment_status="UNFULFILLED", financial_status="PAID", tags=()):
+    """Bulk-style records for one order with a line item per quantity."""
+    order_id = f"gid://shopify/Order/{order_number}"
+    records = [{"id": order_id, "name": f"#{order_number}", "createdAt": created_at, "tags": list(tags),
+                "displayFulfillmentStatus": fulfillment_status, "displayFinancialStatus": financial_status, "cancelledAt": None}]
+    for index, quantity in enumerate(quantities):
+        records.append({"id": f"gid://shopify/LineItem/{order_number}{index}", "sku": f"SKU-{index}", "variantTitle": "",
+                        "quantity": quantity, "unfulfilledQuantity": quantity, "__parentId": order_id})
+    return records
+
+
+def test_upsert_replaces_orders_by_id():
+    """Upserting an order again replaces it and all of its line items."""
+    store = SalesStore(tempfile.mkdtemp())
+    store.upsert(*parse_bulk_orders(order_records(1, "2024-03-04T10:00:00Z", [1, 2]) + order_records(2, "2024-03-06T10:00:00Z", [3])))
+    store.upsert(*parse_bulk_orders(order_records(1, "2024-03-04T10:00:00Z", [5], fulfillment_status="FULFILLED")))
+
+    orders_df, line_items_df = store.load()
+
+    assert sorted(orders_df["order_id"]) == ["gid://shopify/Order/1", "gid://shopify/Order/2"]
+    assert orders_df.set_index("order_id").loc["gid://shopify/Order/1", "fulfillment_status"] == "FULFILLED"
+    assert sorted(line_items_df["quantity"]) == [3, 5]
+    assert store.high_water_mark == datetime(2024, 3, 6, 10, tzinfo=timezone.utc)
+    print("✓ Orders replaced by ID")
+
+
+def test_orders_partitioned_by_week():
+    """Orders land in the partition of the Monday starting their week; only new weeks are written."""
+    store = SalesStore(tempfile.mkdtemp())
+    store.upsert(*parse_bulk_orders(order_records(1, "2024-03-04T10:00:00Z", [1]) + order_records(2, "2024-03-10T23:00:00Z", [1])))
+    first_week = store.partition_path("2024-03-04", "orders")
+    written_at = os.path.getmtime(first_week)
+
+    os.utime(first_week, (written_at - 60, written_at - 60))
+    store.upsert(*parse_bulk_orders(order_records(3, "2024-03-11T01:00:00Z", [1])))
+
+    assert store.load_manifest()["partitions"] == ["2024-03-04", "2024-03-11"]
+    assert os.path.getmtime(first_week) == written_at - 60
+    print("✓ Orders partitioned by week")
+
+
+def test_delete_removes_orders_and_line_items():
+    """Deleted orders disappear with their line items; other orders in the week are kept."""
+    store = SalesStore(tempfile.mkdtemp())
+    store.upsert(*parse_bulk_orders(order_records(1, "2024-03-04T10:00:00Z", [1, 2]) + order_records(2, "2024-03-05T10:00:00Z", [3])))
+
+    orders_df, _ = parse_bulk_orders(order_records(1, "2024-03-04T10:00:00Z", [], financial_status="REFUNDED"))
+    store.delete(orders_df)
+
+    orders_df, line_items_df = store.load()
+    assert list(orders_df["order_id"]) == ["gid://shopify/Order/2"]
+    assert list(line_items_df["quantity"]) == [3]
+    print("✓ Orders deleted with their line items")
+
+
+def test_qualifying_orders_matches_search_filter():
+    """Delta syncs keep only orders the full fetch's search query would return."""
+    orders_df, _ = parse_bulk_orders(
+        order_records(1, "2024-03-04T10:00:00Z", [], fulfillment_status="FULFILLED")
+        + order_records(2, "2024-03-04T10:00:00Z", [], fulfillment_status="ON_HOLD", financial_status="PENDING")
+        + order_records(3, "2024-03-04T10:00:00Z", [], financial_status="REFUNDED")
+        + order_records(4, "2024-03-04T10:00:00Z", [], tags=["Wholesale", "exclude from forecast"])
+        + order_records(5, "2024-03-04T10:00:00Z", [], fulfillment_status="RESTOCKED")
+    )
+
+    assert list(qualifying_orders(orders_df)) == [True, True, False, False, False]
+    print("✓ Qualifying orders filtered locally")
+
+
+def test_daily_rollup_follows_upserts():
+    """The daily SKU rollup is rebuilt for the partitions an upsert touches."""
+    store = SalesStore(tempfile.mkdtemp())
+    store.upsert(*parse_bulk_orders(order_records(1, "2024-03-04T10:00:00Z", [1, 2]) + order_records(2, "2024-03-04T20:00:00Z", [3])))
+    store.upsert(*parse_bulk_orders(order_records(1, "2024-03-04T10:00:00Z", [5])))
+
+    daily_sales_df = store.load_daily_rollup().sort_values(["sku", "order_date"])
+
+    assert daily_sales_df.to_dict("records") == [
+        {"sku": "SKU-0", "order_date": datetime(2024, 3, 4), "quantity": 8},
+    ]
+    print("✓ Daily rollup rebuilt on upsert")
+
+
+def test_evict_drops_weeks_outside_window():
+    """Partitions of weeks before the window are removed."""
+    store = SalesStore(tempfile.mkdtemp(), window_weeks=2)
+    store.upsert(*parse_bulk_orders(order_records(1, "2024-01-01T10:00:00Z", [1]) + order_records(2, "2024-03-04T10:00:00Z", [1])))
+
+    store.evict(now=datetime(2024, 3, 8, tzinfo=timezone.utc))
+
+    orders_df, _ = store.load()
+    assert list(orders_df["order_id"]) == ["gid://shopify/Order/2"]
+    assert not os.path.exists(os.path.join(store.directory, "week=2024-01-01"))
+    print("✓ Old weeks evicted")
+
+
+def test_sales_sync_watermark_follows_reused_bulk_export():
+    """A sales sync that reuses or attaches to an earlier export takes the export's start as its watermark."""
+    now = datetime.now(timezone.utc)
+    created_at = now - timedelta(minutes=3)
+    operations = {
+        "completed": {"id": "gid://shopify/BulkOperation/1", "status": "COMPLETED", "createdAt": created_at.isoformat(),
+                      "completedAt": (now - timedelta(minutes=1)).isoformat(), "url": "https://example.com/1.jsonl"},
+        "running": {"id": "gid://shopify/BulkOperation/2", "status": "RUNNING", "createdAt": created_at.isoformat()},
+    }
+    original = (utils.cache.CACHE_DIR, utils.shopify.get_tracked_bulk_operation, utils.shopify.get_bulk_operation,
+                fetch.shopify.SALES_STORE, fetch.shopify.choose_sales_fetch_strategy, fetch.shopify.submit_bulk_operation,
+                fetch.shopify.collect_bulk_operation)
+    utils.shopify.get_tracked_bulk_operation = lambda key: {"id": operations[key]["id"]}
+    try:
+        for key, operation in operations.items():
+            utils.shopify.get_bulk_operation = lambda bulk_operation_id, operation=operation: operation
+            assert find_reusable_bulk_operation(key, timedelta(minutes=15)) == operation
+
+        utils.cache.CACHE_DIR = tempfile.mkdtemp()
+        fetch.shopify.SALES_STORE = SalesStore(tempfile.mkdtemp())
+        fetch.shopify.choose_sales_fetch_strategy = lambda search_query, window_start: "bulk"
+        fetch.shopify.collect_bulk_operation = lambda key, bulk_operation, stream=False: iter(order_records(1, now.strftime("%Y-%m-%dT%H:%M:%SZ"), [1]))
+        for operation in operations.values():
+            fetch.shopify.submit_bulk_operation = lambda inner_query, operation=operation: ("key", operation)
+            fetch.shopify.fetch_shopify_sales_data(use_cache=False)
+            assert fetch.shopify.SALES_STORE.sync_watermark == created_at
+            assert fetch.shopify.SALES_STORE.load_daily_rollup()["quantity"].sum() == 1
+
+        # A freshly started export keeps the time the sync started
+        fresh = {"id": "gid://shopify/BulkOperation/3", "status": "CREATED", "createdAt": (datetime.now(timezone.utc) + timedelta(seconds=1)).isoformat()}
+        fetch.shopify.submit_bulk_operation = lambda inner_query: ("key", fresh)
+        before_sync = datetime.now(timezone.utc)
+        fetch.shopify.fetch_shopify_sales_data(use_cache=False)
+        assert before_sync <= fetch.shopify.SALES_STORE.sync_watermark < datetime.fromisoformat(fresh["createdAt"])
+    finally:
+        (utils.cache.CACHE_DIR, utils.shopify.get_tracked_bulk_operation, utils.shopify.get_bulk_operation,
+         fetch.shopify.SALES_STORE, fetch.shopify.choose_sales_fetch_strategy, fetch.shopify.submit_bulk_operation,
+         fetch.shopify.collect_bulk_operation) = original
+    print("✓ Reused and attached sales exports set the watermark to their start time")
+
+
+def test_refreshing_sales_refetches_the_full_window():
+    """refresh=shopify_sales ignores the sync watermark, and clearing the store removes it."""
+    original = (utils.cache.CACHE_DIR, fetch.shopify.SALES_STORE, fetch.shopify.choose_sales_fetch_strategy,
+                fetch.shopify.fetch_shopify_orders_paginated)
+    try:
+        search_queries = []
+        def fake_fetch_shopify_orders_paginated(search_query):
+            search_queries.append(search_query)
+            return order_records(1, datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"), [1])
+        utils.cache.CACHE_DIR = tempfile.mkdtemp()
+        fetch.shopify.SALES_STORE = SalesStore(tempfile.mkdtemp())
+        fetch.shopify.choose_sales_fetch_strategy = lambda search_query, window_start: "paginated"
+        fetch.shopify.fetch_shopify_orders_paginated = fake_fetch_shopify_orders_paginated
+
+        fetch.shopify.fetch_shopify_sales_data(use_cache=True)
+        fetch.shopify.fetch_shopify_sales_data(use_cache=True)
+        fetch.shopify.fetch_shopify_sales_data(use_cache=True, cache_policy=CachePolicy(refresh=["shopify_sales"]))
+        assert ["updated_at" in search_query for search_query in search_queries] == [False, True, False]
+        print("✓ Refreshing shopify_sales refetches the full window")
+
+        fetch.shopify.clear_sales_store()
+        assert fetch.shopify.SALES_STORE.sync_watermark is None
+        assert fetch.shopify.SALES_STORE.is_empty()
+        print("✓ Clearing the sales store removes its watermark")
+    finally:
+        (utils.cache.CACHE_DIR, fetch.shopify.SALES_STORE, fetch.shopify.choose_sales_fetch_strategy,
+         fetch.shopify.fetch_shopify_orders_paginated) = original
+
+
+def test_empty_delta_advances_watermark():
+    """A delta with no updated orders keeps the stored orders and still advances the watermark."""
+    original = fetch.shopify.SALES_STORE
+    try:
+        fetch.shopify.SALES_STORE = SalesStore(tempfile.mkdtemp())
+        synced_at = datetime.now(timezone.utc)
+        fetch.shopify.SALES_STORE.upsert(*parse_bulk_orders(order_records(1, synced_at.strftime("%Y-%m-%dT%H:%M:%SZ"), [2])))
+        for new_data in ([], iter([])):
+            rollup = fetch.shopify.merge_sales_data(True, new_data, synced_at)
+            assert rollup["quantity"].sum() == 2
+            assert fetch.shopify.SALES_STORE.sync_watermark == synced_at
+            synced_at += timedelta(minutes=1)
+    finally:
+        fetch.shopify.SALES_STORE = original
+    print("✓ Empty delta advances the watermark")
+
+
+def test_sales_fetch_strategy_follows_order_count():
+    """Small deltas are paginated and large windows use a bulk export; without a count the window length decides."""
+    original = fetch.shopify.fetch_shopify_orders_count
+    counts = []
+    try:
+        def fake_fetch_shopify_orders_count(search_query, limit=10000):
+            counts.append(limit)
+            return order_count
+        fetch.shopify.fetch_shopify_orders_count = fake_fetch_shopify_orders_count
+        now = datetime.now(timezone.utc)
+
+        for order_count, window_start, strategy in (
+            (0, now - timedelta(days=365), "paginated"),
+            (fetch.shopify.PAGINATED_SALES_MAX_ORDERS, now - timedelta(days=365), "paginated"),
+            (fetch.shopify.PAGINATED_SALES_MAX_ORDERS + 1, now - timedelta(hours=1), "bulk"),
+            (None, now - timedelta(days=fetch.shopify.PAGINATED_SALES_MAX_DAYS), "paginated"),
+            (None, now - timedelta(days=fetch.shopify.PAGINATED_SALES_MAX_DAYS + 1), "bulk"),
+        ):
+            assert fetch.shopify.choose_sales_fetch_strategy("query", window_start) == strategy, (order_count, strategy)
+        assert set(counts) == {fetch.shopify.PAGINATED_SALES_MAX_ORDERS + 1}
+    finally:
+        fetch.shopify.fetch_shopify_orders_count = original
+    print("✓ Sales fetch strategy follows the order count, or the window length without one")
+
+
+if __name__ == "__main__":
+    test_upsert_replaces_orders_by_id()
+    test_orders_partitioned_by_week()
+    test_delete_removes_orders_and_line_items()
+    test_qualifying_orders_matches_search_filter()
+    test_daily_rollup_follows_upserts()
+    test_evict_drops_weeks_outside_window()
+    test_sales_sync_watermark_follows_reused_bulk_export()
+    test_refreshing_sales_refetches_the_full_window()
+    test_empty_delta_advances_watermark()
+    test_sales_fetch_strategy_follows_order_count()
@@ -0,0 +1,122 @@
+import sys
+import os
+import json
+import requests
+
+# Add the project directory to the Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import utils.shiphero
+from utils.shiphero import ShipHeroClient, ShipHeroCreditBucket, ShipHeroAPIError
+
+QUERY = "query { account { data { id } } }"
+MUTATION = "mutation { purchase_order_create(data: {}) { request_id } }"
+
+
+class FakeTokenStore:
+    """Hands out token-1 until a rejected token is refreshed."""
+
+    def __init__(self):
+        self.token = "token-1"
+        self.rejected = []
+
+    def get_token(self):
+        return self.token
+
+    def refresh_rejected_token(self, token):
+        self.rejected.append(token)
+        self.token = "token-2"
+
+
+def make_response(status_code, body=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = json.dumps(body or {}).encode()
+    return response
+
+
+def make_client(outcomes):
+    """A client whose session answers (or raises) each outcome in turn and records the tokens sent."""
+    client = ShipHeroClient(endpoint="https://shiphero.test/graphql", credit_bucket=ShipHeroCreditBucket(capacity=10000, refill_rate=10000),
+                            token_store=FakeTokenStore(), max_retries=3)
+    client.sent_tokens = []
+
+    def fake_post(url, json=None, headers=None, timeout=None):
+        client.sent_tokens.append(headers["Authorization"])
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    client.session.post = fake_post
+    return client
+
+
+def record_backoff():
+    """Replace the jitter draw with one that records its bounds and never sleeps."""
+    bounds = []
+    original_uniform = utils.shiphero.random.uniform
+    utils.shiphero.random.uniform = lambda low, high: bounds.append((low, high)) or 0
+    return bounds, original_uniform
+
+
+def test_queries_retry_with_jittered_backoff():
+    bounds, original_uniform = record_backoff()
+    try:
+        client = make_client([make_response(502), requests.exceptions.ReadTimeout(), make_response(200, {"data": {"ok": True}})])
+        assert client.execute(QUERY) == {"data": {"ok": True}}
+        assert bounds == [(0, 1.0), (0, 2.0)]
+
+        client = make_client([make_response(503)] * 4)
+        try:
+            client.execute(QUERY)
+            assert False, "Expected the retries to run out"
+        except ShipHeroAPIError:
+            pass
+        assert len(client.sent_tokens) == 4
+    finally:
+        utils.shiphero.random.uniform = original_uniform
+    print("✓ Queries are retried with full-jitter exponential backoff until the retries run out")
+
+
+def test_rejected_token_is_refreshed_once():
+    client = make_client([make_response(401), make_response(200, {"data": {}})])
+    assert client.execute(QUERY) == {"data": {}}
+    assert client.token_store.rejected == ["token-1"]
+    assert client.sent_tokens == ["Bearer token-1", "Bearer token-2"]
+
+    client = make_client([make_response(401), make_response(401)])
+    try:
+        client.execute(QUERY)
+        assert False, "Expected a second 401 to fail"
+    except ShipHeroAPIError:
+        pass
+    assert len(client.token_store.rejected) == 1
+    print("✓ A 401 refreshes the token and retries once")
+
+
+def test_mutations_are_not_retried_once_sent():
+    bounds, original_uniform = record_backoff()
+    try:
+        for outcome in (make_response(502), requests.exceptions.ReadTimeout(), requests.exceptions.ConnectionError()):
+            client = make_client([outcome, make_response(200, {"data": {}})])
+            try:
+                client.execute(MUTATION, idempotent=False)
+                assert False, "Expected the mutation to fail without a retry"
+            except (ShipHeroAPIError, requests.exceptions.RequestException):
+                pass
+            assert len(client.sent_tokens) == 1
+
+        # Requests ShipHero cannot have processed are still retried
+        client = make_client([requests.exceptions.ConnectTimeout(), make_response(429), make_response(200, {"data": {"created": True}})])
+        assert client.execute(MUTATION, idempotent=False) == {"data": {"created": True}}
+        assert len(client.sent_tokens) == 3
+    finally:
+        utils.shiphero.random.uniform = original_uniform
+    print("✓ Mutations are only retried when they cannot have been processed")
+
+
+if __name__ == "__main__":
+    test_queries_retry_with_jittered_backoff()
+    test_rejected_token_is_refreshed_once()
+    test_mutations_are_not_retried_once_sent()
@@ -0,0 +1,81 @@
+import sys
+import os
+import time
+
+# Add the project directory to the Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.shiphero import ShipHeroCreditBucket, get_response_complexity, next_page_size
+
+
+def test_acquire_within_budget_does_not_wait():
+    bucket = ShipHeroCreditBucket(capacity=100, refill_rate=1000)
+    start = time.monotonic()
+    bucket.acquire(40)
+    bucket.acquire(40)
+    assert time.monotonic() - start < 0.05
+    print("✓ Requests within the budget are sent immediately")
+
+
+def test_acquire_waits_for_refill():
+    bucket = ShipHeroCreditBucket(capacity=100, refill_rate=1000)
+    bucket.acquire(100)
+    start = time.monotonic()
+    bucket.acquire(50)
+    elapsed = time.monotonic() - start
+    assert elapsed >= 0.04, f"Expected to wait for the refill, waited {elapsed:.3f}s"
+    print(f"✓ Waited {elapsed:.3f}s for the bucket to refill")
+
+
+def test_settle_records_observed_complexity():
+    bucket = ShipHeroCreditBucket(capacity=1000, refill_rate=0.001)
+    query = "query { warehouse_products { complexity } }"
+    reserved = bucket.acquire(bucket.estimate(query))
+    bucket.settle(query, reserved, 11)
+    assert bucket.estimate(query) == 11
+    assert round(bucket.credits) == 989
+    print("✓ Reservation settled with the reported complexity")
+
+
+def test_sync_with_remaining_credits():
+    bucket = ShipHeroCreditBucket(capacity=1000, refill_rate=0.001)
+    bucket.sync(25)
+    assert round(bucket.credits) == 25
+    print("✓ Bucket resynced from a throttling error")
+
+
+def test_get_response_complexity():
+    result = {"data": {"warehouse_products": {"complexity": 101, "request_id": "abc", "data": {}}}}
+    assert get_response_complexity(result) == 101
+    assert get_response_complexity({"errors": [{"code": 30}]}) == 0
+    print("✓ Complexity read from the response")
+
+
+def test_estimate_scales_with_page_size():
+    bucket = ShipHeroCreditBucket(capacity=1000, refill_rate=0.001)
+    query = "query ($first: Int!) { warehouse_products { complexity } }"
+    bucket.record(query, 101, page_size=100)
+    assert bucket.estimate(query, page_size=200) == 202
+    print("✓ Estimate scaled to the requested page size")
+
+
+def test_next_page_size():
+    # 101 credits for 100 edges: a 1001 credit target allows 991 edges, capped at 500
+    assert next_page_size(101, 100, target_complexity=1001, max_page_size=500) == 500
+    # 1010 credits for 10 purchase orders: a 1001 credit target allows 9
+    assert next_page_size(1010, 10, target_complexity=1001, max_page_size=500) == 9
+    # Never drops below one edge per page
+    assert next_page_size(5000, 1, target_complexity=1001, max_page_size=500) == 1
+    # No reported complexity keeps the current page size
+    assert next_page_size(None, 100) == 100
+    print("✓ Page size adapted to the observed complexity")
+
+
+if __name__ == "__main__":
+    test_acquire_within_budget_does_not_wait()
+    test_acquire_waits_for_refill()
+    test_settle_records_observed_complexity()
+    test_sync_with_remaining_credits()
+    test_get_response_complexity()
+    test_estimate_scales_with_page_size()
+    test_next_page_size()
@@ -0,0 +1,54 @@
+import sys
+import os
+import json
+import tempfile
+
+# Add the project directory to the Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.shiphero import iter_inventory_snapshot_nodes
+
+
+def test_iter_inventory_snapshot_nodes():
+    """Snapshot products are parsed into the warehouse_products edge shape used by transform_stock_levels."""
+    snapshot = {
+        "snapshot_id": "abc",
+        "warehouse_id": "V2FyZWhvdXNlOjEwMTU4Mw==",
+        "products": {
+            "SKU-001": {
+                "sku": "SKU-001",
+                "warehouse_products": {
+                    "V2FyZWhvdXNlOjEwMTU4Mw==": {"on_hand": 12, "allocated": 2, "available": 10, "backorder": 0}
+                }
+            },
+            "SKU-002": {
+                "sku": "SKU-002",
+                "warehouse_products": {
+                    "V2FyZWhvdXNlOjEwMTU4Mw==": {"on_hand": 0, "allocated": 3, "available": 0, "backorder": 3}
+                }
+            },
+            "SKU-003": {
+                "sku": "SKU-003",
+                "warehouse_products": {}
+            }
+        }
+    }
+
+    with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as file:
+        json.dump(snapshot, file)
+        path = file.name
+
+    try:
+        nodes = list(iter_inventory_snapshot_nodes(path))
+    finally:
+        os.remove(path)
+
+    assert nodes == [
+        {"node": {"sku": "SKU-001", "on_hand": 12, "allocated": 2, "available": 10, "backorder": 0}},
+        {"node": {"sku": "SKU-002", "on_hand": 0, "allocated": 3, "available": 0, "backorder": 3}},
+    ]
+    print("✓ Snapshot parsed into stock level nodes")
+
+
+if __name__ == "__main__":
+    test_iter_inventory_snapshot_nodes()
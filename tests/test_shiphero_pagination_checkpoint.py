@@ -0,0 +1,107 @@
+import sys
+import os
+import pickle
+import tempfile
+import time
+
+# Add the project directory to the Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import utils.shiphero
+from utils.shiphero import fetch_shiphero_paginated_data, ShipHeroAPIError
+
+QUERY = "query ($first: Int!, $after: String) { warehouse_products { complexity data { edges { node { sku } } } } }"
+
+
+def make_fake_fetch(requested_cursors, fail_on_cursor="never"):
+    """Serve four one-edge pages, raising when fail_on_cursor is requested."""
+    def fake_fetch(query, variables):
+        after = variables["after"]
+        requested_cursors.append(after)
+        if after == fail_on_cursor:
+            raise ShipHeroAPIError("Failed to fetch data from ShipHero API (status 502)")
+        page = 0 if after is None else int(after)
+        return {"data": {"warehouse_products": {"complexity": None, "data": {
+            "pageInfo": {"hasNextPage": page < 3, "endCursor": str(page + 1)},
+            "edges": [{"node": {"sku": f"SKU-{page}"}}]
+        }}}}
+    return fake_fetch
+
+
+def test_resume_from_checkpoint():
+    """A fetch that failed partway resumes from the last saved cursor."""
+    original_fetch = utils.shiphero.fetch_shiphero_with_throttling
+    original_cwd = os.getcwd()
+    os.chdir(tempfile.mkdtemp())
+    try:
+        requested_cursors = []
+        utils.shiphero.fetch_shiphero_with_throttling = make_fake_fetch(requested_cursors, fail_on_cursor="2")
+        try:
+            fetch_shiphero_paginated_data(QUERY, {"first": 1, "after": None}, "warehouse_products", checkpoint_name="test")
+            assert False, "Expected the fetch to fail"
+        except ShipHeroAPIError:
+            pass
+        assert os.path.exists("cache/checkpoints/test.pkl")
+        print("✓ Checkpoint kept after a failed page")
+
+        requested_cursors = []
+        utils.shiphero.fetch_shiphero_with_throttling = make_fake_fetch(requested_cursors)
+        data = fetch_shiphero_paginated_data(QUERY, {"first": 1, "after": None}, "warehouse_products", checkpoint_name="test")
+        assert requested_cursors == ["2", "3"], requested_cursors
+        assert [edge["node"]["sku"] for edge in data] == ["SKU-0", "SKU-1", "SKU-2", "SKU-3"]
+        assert not os.path.exists("cache/checkpoints/test.pkl")
+        print("✓ Resumed from the checkpoint and removed it when done")
+
+        # A different query does not pick up another query's checkpoint
+        requested_cursors = []
+        utils.shiphero.fetch_shiphero_with_throttling = make_fake_fetch(requested_cursors, fail_on_cursor="2")
+        try:
+            fetch_shiphero_paginated_data(QUERY, {"first": 1, "after": None}, "warehouse_products", checkpoint_name="test")
+        except ShipHeroAPIError:
+            pass
+        requested_cursors = []
+        utils.shiphero.fetch_shiphero_with_throttling = make_fake_fetch(requested_cursors)
+        fetch_shiphero_paginated_data(QUERY, {"first": 1, "after": None, "updated_from": "2024-01-01"}, "warehouse_products", checkpoint_name="test")
+        assert requested_cursors[0] is None
+        print("✓ Checkpoint ignored for different variables")
+    finally:
+        utils.shiphero.fetch_shiphero_with_throttling = original_fetch
+        os.chdir(original_cwd)
+
+
+def test_stale_checkpoint_is_discarded():
+    """A checkpoint older than the max age is deleted and the fetch starts over."""
+    original_fetch = utils.shiphero.fetch_shiphero_with_throttling
+    original_cwd = os.getcwd()
+    os.chdir(tempfile.mkdtemp())
+    try:
+        utils.shiphero.fetch_shiphero_with_throttling = make_fake_fetch([], fail_on_cursor="2")
+        try:
+            fetch_shiphero_paginated_data(QUERY, {"first": 1, "after": None}, "warehouse_products", checkpoint_name="test")
+        except ShipHeroAPIError:
+            pass
+
+        # Backdate the checkpoint header past the max age, keeping its pages
+        with open("cache/checkpoints/test.pkl", "rb") as f:
+            header = pickle.load(f)
+            pages = f.read()
+        header["created_at"] = time.time() - utils.shiphero.SHIPHERO_CHECKPOINT_MAX_AGE.total_seconds() - 60
+        with open("cache/checkpoints/test.pkl", "wb") as f:
+            pickle.dump(header, f)
+            f.write(pages)
+
+        requested_cursors = []
+        utils.shiphero.fetch_shiphero_with_throttling = make_fake_fetch(requested_cursors)
+        data = fetch_shiphero_paginated_data(QUERY, {"first": 1, "after": None}, "warehouse_products", checkpoint_name="test")
+        assert requested_cursors == [None, "1", "2", "3"], requested_cursors
+        assert len(data) == 4
+        assert not os.path.exists("cache/checkpoints/test.pkl")
+        print("✓ Stale checkpoint discarded")
+    finally:
+        utils.shiphero.fetch_shiphero_with_throttling = original_fetch
+        os.chdir(original_cwd)
+
+
+if __name__ == "__main__":
+    test_resume_from_checkpoint()
+    test_stale_checkpoint_is_discarded()
@@ -0,0 +1,50 @@
+import sys
+import os
+
+# Add the project directory to the Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import fetch.shiphero
+from fetch.shiphero import fetch_purchase_orders_from_shiphero
+
+
+def line_item_edges(start, stop):
+    return [{"node": {"id": f"li-{index}", "sku": f"SKU-{index}", "quantity": 1, "quantity_received": 0}} for index in range(start, stop)]
+
+
+def test_long_purchase_orders_are_paged():
+    """POs with more line items than the nested page size come back with all of them."""
+    page_size = fetch.shiphero.PO_LINE_ITEMS_PAGE_SIZE
+    purchase_orders = [
+        {"node": {"id": "po-1", "po_number": "PO-1", "fulfillment_status": "pending", "line_items": {
+            "pageInfo": {"hasNextPage": True, "endCursor": str(page_size)}, "edges": line_item_edges(0, page_size)}}},
+        {"node": {"id": "po-2", "po_number": "PO-2", "fulfillment_status": "pending", "line_items": {
+            "pageInfo": {"hasNextPage": False, "endCursor": "2"}, "edges": line_item_edges(0, 2)}}},
+    ]
+    total = page_size * 2 + 5
+    requested = []
+
+    def fake_fetch(query, variables):
+        requested.append((variables["id"], variables["after"]))
+        start = int(variables["after"])
+        stop = min(start + variables["first"], total)
+        return {"data": {"purchase_order": {"complexity": 1, "data": {"line_items": {
+            "pageInfo": {"hasNextPage": stop < total, "endCursor": str(stop)}, "edges": line_item_edges(start, stop)}}}}}
+
+    original = (fetch.shiphero.fetch_shiphero_paginated_data, fetch.shiphero.fetch_shiphero_with_throttling)
+    fetch.shiphero.fetch_shiphero_paginated_data = lambda query, variables, data_key, checkpoint_name=None: purchase_orders
+    fetch.shiphero.fetch_shiphero_with_throttling = fake_fetch
+    try:
+        result = fetch_purchase_orders_from_shiphero("2024-01-01")
+    finally:
+        fetch.shiphero.fetch_shiphero_paginated_data, fetch.shiphero.fetch_shiphero_with_throttling = original
+
+    assert requested == [("po-1", str(page_size)), ("po-1", str(page_size * 2))]
+    assert [edge["node"]["id"] for edge in result[0]["node"]["line_items"]["edges"]] == [f"li-{index}" for index in range(total)]
+    assert not result[0]["node"]["line_items"]["pageInfo"]["hasNextPage"]
+    assert len(result[1]["node"]["line_items"]["edges"]) == 2
+    print("✓ Remaining PO line items paged in")
+
+
+if __name__ == "__main__":
+    test_long_purchase_orders_are_paged()
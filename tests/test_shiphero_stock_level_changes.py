@@ -0,0 +1,52 @@
+import sys
+import os
+import tempfile
+from datetime import datetime, timezone
+
+# Add the project directory to the Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import utils.cache
+import utils.state
+import fetch.shiphero
+from fetch.shiphero import fetch_shiphero_stock_level_changes, save_stock_levels_cache
+from utils.shiphero import parse_stock_levels
+
+WAREHOUSE_ID = "V2FyZWhvdXNlOjE="
+
+
+def product(sku, on_hand, active=True):
+    return {"node": {"id": sku, "sku": sku, "active": active, "on_hand": on_hand, "allocated": 0, "available": on_hand, "backorder": 0}}
+
+
+def test_changes_are_patched_into_cached_stock_levels():
+    """Changed products replace their rows, new ones are added and deactivated ones are dropped."""
+    original = (utils.cache.CACHE_DIR, utils.state.STATE_DIR, fetch.shiphero.fetch_shiphero_paginated_data)
+    requests = []
+
+    def fake_fetch_shiphero_paginated_data(query, variables, data_key, checkpoint_name=None):
+        requests.append(variables)
+        return [product("SKU-B", 7), product("SKU-C", 0, active=False), product("SKU-D", 4)]
+
+    try:
+        utils.cache.CACHE_DIR = tempfile.mkdtemp()
+        utils.state.STATE_DIR = tempfile.mkdtemp()
+        fetch.shiphero.fetch_shiphero_paginated_data = fake_fetch_shiphero_paginated_data
+
+        # Nothing to patch without a cached table and watermark
+        assert fetch_shiphero_stock_level_changes(WAREHOUSE_ID) is None
+
+        synced_at = datetime(2024, 3, 4, 10, 0, tzinfo=timezone.utc)
+        save_stock_levels_cache(WAREHOUSE_ID, parse_stock_levels([product("SKU-A", 1), product("SKU-B", 2), product("SKU-C", 3)]), synced_at)
+        stock_levels = fetch_shiphero_stock_level_changes(WAREHOUSE_ID)
+
+        assert dict(zip(stock_levels["sku"], stock_levels["on_hand"])) == {"SKU-A": 1, "SKU-B": 7, "SKU-D": 4}
+        assert requests[0]["warehouse_id"] == WAREHOUSE_ID
+        assert requests[0]["updated_from"] == "2024-03-04T09:55:00+00:00"
+    finally:
+        utils.cache.CACHE_DIR, utils.state.STATE_DIR, fetch.shiphero.fetch_shiphero_paginated_data = original
+    print("✓ Stock level changes since the watermark are patched into the cached table")
+
+
+if __name__ == "__main__":
+    test_changes_are_patched_into_cached_stock_levels()
@@ -0,0 +1,58 @@
+import sys
+import os
+import tempfile
+import threading
+from datetime import datetime, timedelta
+
+# Add the project directory to the Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import utils.state
+import utils.shiphero
+from utils.shiphero import ShipHeroTokenStore
+
+
+def test_concurrent_callers_refresh_once():
+    """Threads asking for a token that is about to expire trigger a single refresh."""
+    original_state_dir = utils.state.STATE_DIR
+    utils.state.STATE_DIR = tempfile.mkdtemp()
+    refresh_calls = []
+
+    def fake_refresh():
+        refresh_calls.append(1)
+        return f"token-{len(refresh_calls)}", datetime.now() + timedelta(hours=1)
+
+    original_refresh = utils.shiphero.refresh_shiphero_token
+    try:
+        utils.shiphero.refresh_shiphero_token = fake_refresh
+        store = ShipHeroTokenStore(state_name="test_token")
+        store.expiration = datetime.now() + timedelta(minutes=1)
+
+        tokens = []
+        threads = [threading.Thread(target=lambda: tokens.append(store.get_token())) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(refresh_calls) == 1
+        assert set(tokens) == {"token-1"}
+        print("✓ Ten concurrent callers shared a single refresh")
+
+        state = utils.state.load_state("test_token")
+        assert state["access_token"] == "token-1"
+        print("✓ Refreshed token persisted to the state file")
+
+        # A rejected token that was already replaced does not trigger another refresh
+        store.refresh_rejected_token("stale-token")
+        assert len(refresh_calls) == 1
+        store.refresh_rejected_token("token-1")
+        assert len(refresh_calls) == 2
+        print("✓ Rejected tokens are refreshed only once")
+    finally:
+        utils.shiphero.refresh_shiphero_token = original_refresh
+        utils.state.STATE_DIR = original_state_dir
+
+
+if __name__ == "__main__":
+    test_concurrent_callers_refresh_once()
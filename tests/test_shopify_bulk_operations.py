@@ -0,0 +1,130 @@
+import sys
+import os
+import tempfile
+import requests
+from datetime import datetime, timedelta, timezone
+
+# Add the project directory to the Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import utils.state
+import utils.shopify
+from utils.shopify import track_bulk_operation, collect_bulk_operation, download_bulk_operation_file, submit_bulk_operation, bulk_operation_key, BULK_OPERATIONS_STATE
+
+
+def test_tracking_prunes_stale_operations():
+    """Writing a tracked operation drops failed entries and entries not seen for a day."""
+    original_state_dir = utils.state.STATE_DIR
+    utils.state.STATE_DIR = tempfile.mkdtemp()
+    try:
+        long_ago = (datetime.now(timezone.utc) - timedelta(days=2)).isoformat()
+        utils.state.save_state(BULK_OPERATIONS_STATE, {
+            "old-delta": {"id": "gid://shopify/BulkOperation/1", "status": "COMPLETED", "completedAt": long_ago, "trackedAt": long_ago},
+            "untimed": {"id": "gid://shopify/BulkOperation/2", "status": "COMPLETED", "completedAt": long_ago},
+        })
+        track_bulk_operation("failed", {"id": "gid://shopify/BulkOperation/3", "status": "FAILED"})
+        track_bulk_operation("running", {"id": "gid://shopify/BulkOperation/4", "status": "RUNNING"})
+        track_bulk_operation("completed", {"id": "gid://shopify/BulkOperation/5", "status": "COMPLETED", "completedAt": datetime.now(timezone.utc).isoformat()})
+
+        operations = utils.state.load_state(BULK_OPERATIONS_STATE)
+        assert sorted(operations) == ["completed", "running"]
+        assert operations["running"]["id"] == "gid://shopify/BulkOperation/4"
+    finally:
+        utils.state.STATE_DIR = original_state_dir
+    print("✓ Failed and stale bulk operations are pruned from the tracking state")
+
+
+def test_collect_treats_missing_status_as_not_found():
+    """An operation node without a status (missing or expired) is reported as not found."""
+    assert collect_bulk_operation("key", {"id": "gid://shopify/BulkOperation/6"}) is None
+    assert collect_bulk_operation("key", {"id": "gid://shopify/BulkOperation/6", "status": None}) is None
+    print("✓ Bulk operations without a status are treated as not found")
+
+
+def test_submit_reattaches_or_reuses_tracked_operations():
+    """A running operation for the query is attached to and a recent result reused; otherwise a new export starts."""
+    now = datetime.now(timezone.utc)
+    query = "{ products { edges { node { id } } } }"
+    original = (utils.state.STATE_DIR, utils.shopify.get_bulk_operation, utils.shopify.start_bulk_operation)
+    started = []
+
+    def fake_start_bulk_operation(inner_query):
+        started.append(inner_query)
+        return {"data": {"bulkOperationRunQuery": {"userErrors": [], "bulkOperation": {
+            "id": "gid://shopify/BulkOperation/new", "status": "CREATED", "createdAt": now.isoformat()}}}}
+
+    try:
+        utils.state.STATE_DIR = tempfile.mkdtemp()
+        utils.shopify.start_bulk_operation = fake_start_bulk_operation
+        for tracked, max_result_age, reused in (
+            ({"status": "RUNNING"}, timedelta(minutes=15), True),
+            ({"status": "COMPLETED", "completedAt": (now - timedelta(minutes=5)).isoformat()}, timedelta(minutes=15), True),
+            ({"status": "COMPLETED", "completedAt": (now - timedelta(minutes=5)).isoformat()}, timedelta(minutes=1), False),
+            ({"status": "FAILED"}, timedelta(minutes=15), False),
+        ):
+            operation = dict(tracked, id="gid://shopify/BulkOperation/old", createdAt=(now - timedelta(minutes=10)).isoformat())
+            track_bulk_operation(bulk_operation_key(query), operation)
+            utils.shopify.get_bulk_operation = lambda bulk_operation_id, operation=operation: operation
+            started.clear()
+
+            key, bulk_operation = submit_bulk_operation(query, max_result_age)
+            assert key == bulk_operation_key(query)
+            assert (bulk_operation["id"] == "gid://shopify/BulkOperation/old") == reused, tracked
+            assert len(started) == (0 if reused else 1)
+    finally:
+        utils.state.STATE_DIR, utils.shopify.get_bulk_operation, utils.shopify.start_bulk_operation = original
+    print("✓ Tracked bulk operations are reattached or reused instead of starting a new export")
+
+
+class FakeDownload:
+    """Streamed response serving chunks, optionally failing after them like a dropped connection."""
+
+    def __init__(self, status_code, chunks, fail=False):
+        self.status_code = status_code
+        self.chunks = chunks
+        self.fail = fail
+        self.text = ""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def iter_content(self, chunk_size=None):
+        yield from self.chunks
+        if self.fail:
+            raise requests.exceptions.ChunkedEncodingError("Connection broken")
+
+
+def test_download_resumes_with_range_requests():
+    """An interrupted download continues from the bytes on disk; a 200 to a ranged request restarts it."""
+    original_get = utils.shopify.requests.get
+    for responses, expected_ranges in (
+        ([FakeDownload(200, [b"abc"], fail=True), FakeDownload(206, [b"def"])], [None, "bytes=3-"]),
+        ([FakeDownload(200, [b"abc"], fail=True), FakeDownload(200, [b"abcdef"])], [None, "bytes=3-"]),
+    ):
+        ranges = []
+
+        def fake_get(url, headers=None, stream=False, timeout=None):
+            ranges.append((headers or {}).get("Range"))
+            return responses.pop(0)
+
+        utils.shopify.requests.get = fake_get
+        try:
+            path = os.path.join(tempfile.mkdtemp(), "bulk", "1.jsonl")
+            assert download_bulk_operation_file("https://example.com/1.jsonl", path) == path
+            with open(path, "rb") as file:
+                assert file.read() == b"abcdef"
+            assert ranges == expected_ranges
+            assert not os.path.exists(path + ".part")
+        finally:
+            utils.shopify.requests.get = original_get
+    print("✓ Interrupted bulk downloads resume with HTTP Range requests")
+
+
+if __name__ == "__main__":
+    test_tracking_prunes_stale_operations()
+    test_collect_treats_missing_status_as_not_found()
+    test_download_resumes_with_range_requests()
+    test_submit_reattaches_or_reuses_tracked_operations()
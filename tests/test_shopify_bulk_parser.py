@@ -0,0 +1,72 @@
+import sys
+import os
+
+# Add the project directory to the Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.shopify import parse_bulk_orders, parse_bulk_inventory
+
+
+def test_parse_bulk_orders():
+    """Line items are joined to their order while reading, with typed columns."""
+    records = [
+        {"id": "gid://shopify/Order/1", "name": "#1001", "createdAt": "2024-03-04T10:00:00Z", "tags": ["Wholesale", "Rush"],
+         "displayFulfillmentStatus": "FULFILLED", "displayFinancialStatus": "PAID", "cancelledAt": None},
+        {"id": "gid://shopify/LineItem/11", "sku": "SKU-001", "variantTitle": "M", "quantity": 2, "unfulfilledQuantity": 0, "__parentId": "gid://shopify/Order/1"},
+        {"id": "gid://shopify/LineItem/12", "sku": "SKU-002", "variantTitle": "L", "quantity": 1, "unfulfilledQuantity": 1, "__parentId": "gid://shopify/Order/1"},
+        {"id": "gid://shopify/Order/2", "name": "#1002", "createdAt": "2024-03-05T23:30:00Z", "tags": [],
+         "displayFulfillmentStatus": "UNFULFILLED", "displayFinancialStatus": "PENDING", "cancelledAt": None},
+        {"id": "gid://shopify/LineItem/21", "sku": "SKU-001", "variantTitle": "M", "quantity": 5, "unfulfilledQuantity": 5, "__parentId": "gid://shopify/Order/2"},
+    ]
+
+    orders_df, line_items_df = parse_bulk_orders(iter(records))
+
+    assert list(orders_df["order_number"]) == ["#1001", "#1002"]
+    assert list(orders_df["order_tags"]) == ["Wholesale, Rush", ""]
+    assert list(line_items_df["order_id"]) == ["gid://shopify/Order/1", "gid://shopify/Order/1", "gid://shopify/Order/2"]
+    assert str(line_items_df["quantity"].dtype) == "int64"
+    assert list(line_items_df["created_at"].dt.strftime("%Y-%m-%d")) == ["2024-03-04", "2024-03-04", "2024-03-05"]
+    print("✓ Orders and line items parsed in one pass")
+
+
+def test_parse_bulk_inventory():
+    """Inventory levels are joined to their variant's SKU."""
+    records = [
+        {"id": "gid://shopify/Product/1", "title": "Tee"},
+        {"id": "gid://shopify/ProductVariant/1", "title": "M", "sku": "SKU-001", "inventoryItem": {"id": "gid://shopify/InventoryItem/1"}, "__parentId": "gid://shopify/Product/1"},
+        {"location": {"id": "gid://shopify/Location/1", "name": "Warehouse"},
+         "quantities": [{"name": "available", "quantity": 4}, {"name": "committed", "quantity": 3}, {"name": "on_hand", "quantity": 7}],
+         "__parentId": "gid://shopify/ProductVariant/1"},
+    ]
+
+    levels_df = parse_bulk_inventory(records)
+
+    assert levels_df.to_dict("records") == [{
+        "sku": "SKU-001", "variant_id": "gid://shopify/ProductVariant/1",
+        "location_id": "gid://shopify/Location/1", "location_name": "Warehouse",
+        "available": 4, "incoming": 0, "committed": 3, "on_hand": 7
+    }]
+    print("✓ Inventory levels joined to their SKU")
+
+
+def test_empty_results_keep_column_types():
+    """An export with no records gives empty tables with the same column types as a full one."""
+    orders_df, line_items_df = parse_bulk_orders(iter([]))
+    assert {column: str(dtype) for column, dtype in orders_df.dtypes.items()} == {
+        "order_id": "object", "order_number": "object", "created_at": "datetime64[ns, UTC]", "order_tags": "object",
+        "fulfillment_status": "object", "financial_status": "object", "cancelled_at": "datetime64[ns, UTC]"}
+    assert {column: str(dtype) for column, dtype in line_items_df.dtypes.items()} == {
+        "line_item_id": "object", "order_id": "object", "sku": "object", "variant_title": "object",
+        "quantity": "int64", "unfulfilled_quantity": "int64", "created_at": "datetime64[ns, UTC]"}
+    assert orders_df["order_tags"].str.lower().empty
+
+    levels_df = parse_bulk_inventory([])
+    assert str(levels_df["sku"].dtype) == "object" and str(levels_df["location_id"].dtype) == "object"
+    assert str(levels_df["available"].dtype) == "int64"
+    print("✓ Empty results keep their column types")
+
+
+if __name__ == "__main__":
+    test_parse_bulk_orders()
+    test_parse_bulk_inventory()
+    test_empty_results_keep_column_types()
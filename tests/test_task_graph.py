@@ -0,0 +1,59 @@
+import sys
+import os
+import time
+
+# Add the project directory to the Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.tasks import run_task_graph
+
+
+def slow(value, delay=0.2):
+    """A task that takes delay seconds to return value."""
+    def task(*inputs):
+        time.sleep(delay)
+        return value + sum(inputs)
+    return task
+
+
+def test_independent_tasks_run_concurrently():
+    """Independent fetches overlap, and a dependent task receives its dependencies' results in order."""
+    started_at = time.monotonic()
+    results = run_task_graph({
+        "a": (slow(1), []),
+        "b": (slow(2), []),
+        "c": (slow(3), []),
+        "ab": (lambda a, b: (a, b), ["a", "b"]),
+        "abc": (lambda ab, c: ab + (c,), ["ab", "c"]),
+    })
+    elapsed = time.monotonic() - started_at
+
+    assert results["ab"] == (1, 2)
+    assert results["abc"] == (1, 2, 3)
+    assert elapsed < 0.4, f"tasks ran sequentially ({elapsed:.2f}s)"
+    print("✓ Independent tasks run concurrently and dependents get their inputs")
+
+
+def test_failures_and_bad_graphs_raise():
+    def fail():
+        raise RuntimeError("fetch failed")
+
+    calls = []
+    try:
+        run_task_graph({"fetch": (fail, []), "transform": (lambda data: calls.append(data), ["fetch"])})
+        assert False, "failure not raised"
+    except RuntimeError:
+        pass
+    assert calls == []
+
+    try:
+        run_task_graph({"transform": (lambda data: data, ["missing"])})
+        assert False, "unknown dependency not rejected"
+    except ValueError:
+        pass
+    print("✓ A failing task stops its dependents and bad graphs are rejected")
+
+
+if __name__ == "__main__":
+    test_independent_tasks_run_concurrently()
+    test_failures_and_bad_graphs_raise()
@@ -0,0 +1,84 @@
+import sys
+import os
+import copy
+import pandas as pd
+
+# Add the project directory to the Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from transform import transform_stock_levels, transform_sales_data, transform_product_metadata, prepare_merged_replenishment_df
+
+
+def sample_inputs():
+    """Small raw inputs in the shapes the fetchers return."""
+    today = pd.Timestamp.now().normalize()
+    stock_levels_data = [
+        {"node": {"id": "1", "sku": "SKU-001", "on_hand": 10, "allocated": 0, "available": 10, "backorder": 0}},
+        {"node": {"id": "2", "sku": "SKU-002", "on_hand": 1, "allocated": 0, "available": 1, "backorder": 0}},
+    ]
+    incoming_stock_data = pd.DataFrame({"sku": ["SKU-001"], "incoming": [5]})
+    committed_stock_data = [
+        {"id": "gid://shopify/ProductVariant/1", "sku": "SKU-002", "__parentId": "gid://shopify/Product/1"},
+        {"location": {"id": "gid://shopify/Location/71392264438", "name": "Warehouse"},
+         "quantities": [{"name": "committed", "quantity": 3}], "__parentId": "gid://shopify/ProductVariant/1"},
+    ]
+    sales_data = [
+        {"id": "gid://shopify/Order/1", "name": "#1001", "createdAt": (today - pd.Timedelta(days=10)).strftime("%Y-%m-%dT10:00:00Z"),
+         "tags": ["Rush"], "displayFulfillmentStatus": "FULFILLED", "displayFinancialStatus": "PAID", "cancelledAt": None},
+        {"id": "gid://shopify/LineItem/1", "sku": "SKU-001", "variantTitle": "M", "quantity": 2, "unfulfilledQuantity": 0,
+         "__parentId": "gid://shopify/Order/1"},
+    ]
+    product_metadata = [
+        {"SKU": "SKU-001", "Option1 Value": "M", "Position": 1, "Product Name": "Tee", "Category": ["Tops"],
+         "Subcategory": "Tees", "Product Number": "100", "Product Type (Internal)": "Tee", "Supplier (Plain Text)": "Acme",
+         "Status Shopify (Shopify)": "active", "Decoration Group (Plain Text)": "Screen", "Artwork (Title)": "Logo",
+         "Cost-Production: Total": 4.5, "Stocked Status": "Stocked"},
+        {"SKU": "SKU-002", "Option1 Value": "L", "Position": 2, "Product Name": "Tee", "Category": ["Tops"],
+         "Subcategory": "Tees", "Product Number": "100", "Product Type (Internal)": "Tee", "Supplier (Plain Text)": "Acme",
+         "Status Shopify (Shopify)": "active", "Decoration Group (Plain Text)": "Screen", "Artwork (Title)": "Logo",
+         "Cost-Production: Total": 4.5, "Stocked Status": "Stocked"},
+    ]
+    return stock_levels_data, incoming_stock_data, committed_stock_data, sales_data, product_metadata
+
+
+def run_transforms(stock_levels_data, incoming_stock_data, committed_stock_data, sales_data, product_metadata):
+    stock_levels_df = transform_stock_levels(stock_levels_data, incoming_stock_data, committed_stock_data)
+    sales_df = transform_sales_data(sales_data)
+    product_metadata_df = transform_product_metadata(product_metadata)
+    return stock_levels_df, sales_df, product_metadata_df
+
+
+def test_transforms_leave_inputs_unchanged():
+    """Every transform, including the merge, leaves its inputs as they were."""
+    inputs = sample_inputs()
+    originals = copy.deepcopy(inputs)
+
+    stock_levels_df, sales_df, product_metadata_df = run_transforms(*inputs)
+    transformed = [df.copy() for df in (stock_levels_df, sales_df, product_metadata_df)]
+    prepare_merged_replenishment_df(stock_levels_df, sales_df, product_metadata_df)
+
+    stock_levels_data, incoming_stock_data, committed_stock_data, sales_data, product_metadata = inputs
+    assert stock_levels_data == originals[0]
+    pd.testing.assert_frame_equal(incoming_stock_data, originals[1])
+    assert committed_stock_data == originals[2]
+    assert sales_data == originals[3]
+    assert product_metadata == originals[4]
+    for df, before in zip((stock_levels_df, sales_df, product_metadata_df), transformed):
+        pd.testing.assert_frame_equal(df, before)
+    print("✓ Transform inputs unchanged")
+
+
+def test_transforms_repeatable_on_same_inputs():
+    """Transforming the same in-memory data twice gives the same result."""
+    inputs = sample_inputs()
+
+    first = prepare_merged_replenishment_df(*run_transforms(*inputs)).drop(columns=["updated_at"])
+    second = prepare_merged_replenishment_df(*run_transforms(*inputs)).drop(columns=["updated_at"])
+
+    pd.testing.assert_frame_equal(first, second)
+    print("✓ Transforms repeatable")
+
+
+if __name__ == "__main__":
+    test_transforms_leave_inputs_unchanged()
+    test_transforms_repeatable_on_same_inputs()
@@ -0,0 +1,50 @@
+import sys
+import os
+import pandas as pd
+
+# Add the project directory to the Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from transform.sales_data import sales_week_index, transform_sales_data
+
+
+def test_week_index_ends_on_last_complete_week():
+    """Weeks end on the most recent Sunday, or today when today is Sunday."""
+    week_end, labels = sales_week_index("2024-03-13 15:30")  # Wednesday
+    assert week_end == pd.Timestamp("2024-03-10")
+    assert labels[:2] == ["sales_1_weeks_ago_Mar04", "sales_2_weeks_ago_Feb26"]
+    assert len(labels) == 52
+
+    week_end, labels = sales_week_index("2024-03-10 09:00")  # Sunday
+    assert week_end == pd.Timestamp("2024-03-10")
+    assert labels[0] == "sales_1_weeks_ago_Mar04"
+
+    week_end, labels = sales_week_index("2024-03-13", window_weeks=4, week_end_day="SAT")
+    assert week_end == pd.Timestamp("2024-03-09")
+    assert labels == ["sales_1_weeks_ago_Mar03", "sales_2_weeks_ago_Feb25", "sales_3_weeks_ago_Feb18", "sales_4_weeks_ago_Feb11"]
+    print("✓ Week index anchored to the last complete week")
+
+
+def test_transform_sums_daily_sales_into_weeks():
+    """Daily quantities are summed per SKU and week over a fixed week index."""
+    week_end, labels = sales_week_index(pd.Timestamp.now(), window_weeks=3)
+    daily_sales_df = pd.DataFrame({
+        "sku": ["SKU-001", "SKU-001", "SKU-002", "SKU-003", "SKU-003"],
+        "order_date": [week_end, week_end - pd.Timedelta(days=6), week_end - pd.Timedelta(days=7),
+                       week_end + pd.Timedelta(days=1), week_end - pd.Timedelta(days=21)],
+        "quantity": [2, 3, 4, 5, 6],
+    })
+
+    sales_df = transform_sales_data(daily_sales_df, window_weeks=3)
+
+    assert list(sales_df.columns) == ["sku"] + labels
+    assert sales_df.to_dict("records") == [
+        {"sku": "SKU-001", labels[0]: 5, labels[1]: 0, labels[2]: 0},
+        {"sku": "SKU-002", labels[0]: 0, labels[1]: 4, labels[2]: 0},
+    ]
+    print("✓ Daily sales bucketed into weeks")
+
+
+if __name__ == "__main__":
+    test_week_index_ends_on_last_complete_week()
+    test_transform_sums_daily_sales_into_weeks()
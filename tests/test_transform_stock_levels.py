@@ -0,0 +1,112 @@
+import sys
+import os
+import pandas as pd
+
+# Add the project directory to the Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from transform import transform_stock_levels
+from utils import parse_stock_levels
+
+
+def committed_records(sku, committed, location_id="gid://shopify/Location/71392264438", location_name="Warehouse"):
+    """Bulk-style variant and inventory level records for one SKU."""
+    variant_id = f"gid://shopify/ProductVariant/{sku}-{location_id[-2:]}"
+    return [
+        {"id": variant_id, "sku": sku, "__parentId": "gid://shopify/Product/1"},
+        {"location": {"id": location_id, "name": location_name}, "quantities": [{"name": "committed", "quantity": committed}],
+         "__parentId": variant_id},
+    ]
+
+
+def test_stock_levels_available_and_backorder():
+    """Committed stock is netted against On Hand into Available and (negative) Backorder as integers."""
+    stock_levels_data = [
+        {"node": {"sku": "SKU-001", "on_hand": 10}},
+        {"node": {"sku": "SKU-002", "on_hand": 2}},
+        {"node": {"sku": "SKU-003", "on_hand": 4}},
+    ]
+    incoming_stock_data = pd.DataFrame({"sku": ["SKU-002"], "incoming": [6]})
+    committed_stock_data = (committed_records("SKU-001", 3) + committed_records("SKU-002", 5)
+                            + committed_records("SKU-003", 9, location_id="gid://shopify/Location/99"))
+
+    stock_levels_df = transform_stock_levels(stock_levels_data, incoming_stock_data, committed_stock_data)
+
+    assert list(stock_levels_df.columns) == ["SKU", "On Hand", "Incoming Stock", "committed", "Available", "Backorder"]
+    assert stock_levels_df.to_dict("records") == [
+        {"SKU": "SKU-001", "On Hand": 10, "Incoming Stock": 0, "committed": 3, "Available": 7, "Backorder": 0},
+        {"SKU": "SKU-002", "On Hand": 2, "Incoming Stock": 6, "committed": 5, "Available": 0, "Backorder": -3},
+        {"SKU": "SKU-003", "On Hand": 4, "Incoming Stock": 0, "committed": 0, "Available": 4, "Backorder": 0},
+    ]
+    assert all(str(dtype) == "int64" for dtype in stock_levels_df.dtypes.iloc[1:])
+    print("✓ Available and Backorder computed")
+
+
+def test_stock_levels_from_compact_committed_table():
+    """The compact committed table gives the same result as the full inventory export."""
+    stock_levels_data = [{"node": {"sku": "SKU-001", "on_hand": 10}}, {"node": {"sku": "SKU-002", "on_hand": 2}}]
+    incoming_stock_data = pd.DataFrame({"sku": ["SKU-002"], "incoming": [6]})
+    committed_inventory = pd.DataFrame({
+        "sku": ["SKU-001", "SKU-002"],
+        "location_id": ["gid://shopify/Location/71392264438", "gid://shopify/Location/99"],
+        "location_name": ["Warehouse", "Store"],
+        "committed": [3, 5],
+    })
+    committed_stock_data = committed_records("SKU-001", 3) + committed_records("SKU-002", 5, location_id="gid://shopify/Location/99")
+
+    pd.testing.assert_frame_equal(
+        transform_stock_levels(stock_levels_data, incoming_stock_data, committed_inventory),
+        transform_stock_levels(stock_levels_data, incoming_stock_data, committed_stock_data)
+    )
+    print("✓ Compact committed table accepted")
+
+
+def test_stock_levels_from_typed_stock_levels_table():
+    """The typed stock levels table the fetcher returns gives the same result as raw edges."""
+    warehouse_ids = ["V2FyZWhvdXNlOjEwMTU4Mw==", "V2FyZWhvdXNlOjIwMDAwMQ=="]
+    stock_levels_data = [
+        {"node": {"sku": "SKU-001", "on_hand": 10, "warehouse_id": warehouse_ids[0]}},
+        {"node": {"sku": "SKU-001", "on_hand": 4, "warehouse_id": warehouse_ids[1]}},
+        {"node": {"sku": "SKU-002", "on_hand": None, "warehouse_id": warehouse_ids[1]}},
+    ]
+    stock_levels_table = parse_stock_levels(stock_levels_data)
+    stock_levels_table["warehouse_id"] = [product["node"]["warehouse_id"] for product in stock_levels_data]
+    incoming_stock_data = pd.DataFrame({"sku": ["SKU-002"], "incoming": [6]})
+    committed_stock_data = committed_records("SKU-001", 3)
+
+    pd.testing.assert_frame_equal(
+        transform_stock_levels(stock_levels_table, incoming_stock_data, committed_stock_data, warehouse_ids=warehouse_ids),
+        transform_stock_levels(stock_levels_data, incoming_stock_data, committed_stock_data, warehouse_ids=warehouse_ids)
+    )
+    print("✓ Typed stock levels table accepted")
+
+
+def test_stock_levels_per_warehouse_and_location():
+    """With several warehouses and locations, totals are kept and a column is added for each."""
+    warehouse_ids = ["V2FyZWhvdXNlOjEwMTU4Mw==", "V2FyZWhvdXNlOjIwMDAwMQ=="]
+    location_ids = ["gid://shopify/Location/71392264438", "gid://shopify/Location/99"]
+    stock_levels_data = [
+        {"node": {"sku": "SKU-001", "on_hand": 10, "warehouse_id": warehouse_ids[0]}},
+        {"node": {"sku": "SKU-001", "on_hand": 4, "warehouse_id": warehouse_ids[1]}},
+        {"node": {"sku": "SKU-002", "on_hand": 1, "warehouse_id": warehouse_ids[1]}},
+    ]
+    incoming_stock_data = pd.DataFrame({"sku": [], "incoming": []})
+    committed_stock_data = committed_records("SKU-001", 3) + committed_records("SKU-002", 2, location_id=location_ids[1], location_name="Store")
+
+    stock_levels_df = transform_stock_levels(stock_levels_data, incoming_stock_data, committed_stock_data,
+                                             warehouse_ids=warehouse_ids, location_ids=location_ids)
+
+    assert stock_levels_df.to_dict("records") == [
+        {"SKU": "SKU-001", "On Hand": 14, "Incoming Stock": 0, "committed": 3, "Available": 11, "Backorder": 0,
+         "On Hand 101583": 10, "On Hand 200001": 4, "committed Warehouse": 3, "committed Store": 0},
+        {"SKU": "SKU-002", "On Hand": 1, "Incoming Stock": 0, "committed": 2, "Available": 0, "Backorder": -1,
+         "On Hand 101583": 0, "On Hand 200001": 1, "committed Warehouse": 0, "committed Store": 2},
+    ]
+    print("✓ Per-warehouse and per-location columns added")
+
+
+if __name__ == "__main__":
+    test_stock_levels_available_and_backorder()
+    test_stock_levels_from_compact_committed_table()
+    test_stock_levels_from_typed_stock_levels_table()
+    test_stock_levels_per_warehouse_and_location()
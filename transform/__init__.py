@@ -1,6 +1,9 @@
 """
 Transform module - Central import point for all data transformation functions.
 This module provides backwards compatibility for imports from the original transform_data.py file.
+
+Transforms never modify their inputs: they work on copies and return new DataFrames, so fetched
+data can be held in memory and transformed again on a later run.
 """
 
 from transform.stock_levels import transform_stock_levels
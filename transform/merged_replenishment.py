@@ -5,17 +5,17 @@ import re
 
 def prepare_merged_replenishment_df(stock_levels_df, sales_df, product_metadata_df):
     """Merge stock levels, sales, and product metadata into a single replenishment DataFrame."""
-    # Rename columns to a standardized convention
-    stock_levels_df.rename(columns={
+    # Rename columns to a standardized convention (on copies; the inputs are left untouched)
+    stock_levels_df = stock_levels_df.rename(columns={
         'SKU': 'sku',
         'On Hand': 'on_hand',
         'committed': 'committed',
         'Available': 'available',
         'Backorder': 'backorder',
         'Incoming Stock': 'incoming'
-    }, inplace=True)
+    })
 
-    product_metadata_df.rename(columns={
+    product_metadata_df = product_metadata_df.rename(columns={
         'SKU': 'sku',
         'Option1 Value': 'option1_value',
         'Position': 'position',
@@ -36,7 +36,7 @@ def prepare_merged_replenishment_df(stock_levels_df, sales_df, product_metadata_
         'Component Color': 'component_color',
         'Blank Preferred Supplier': 'blank_preferred_supplier',
         'Blank Backup Supplier(s)': 'blank_backup_suppliers'
-    }, inplace=True)
+    })
 
     # Inner merge stock_levels_df and product_metadata_df on SKU
     replenishment_df = stock_levels_df.merge(product_metadata_df, on='sku', how='inner')
@@ -73,10 +73,8 @@ def prepare_merged_replenishment_df(stock_levels_df, sales_df, product_metadata_
     print("Ordered Columns:")
     print(ordered_columns)
     
-    replenishment_df = replenishment_df[ordered_columns]
-
-    # Remove position field
-    replenishment_df.drop(columns=['position'], inplace=True)
+    # Reorder and remove position field
+    replenishment_df = replenishment_df[ordered_columns].drop(columns=['position'])
 
     # Remove extra characters from all columns with type string
     for column in replenishment_df.select_dtypes(include='object').columns:
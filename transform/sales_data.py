@@ -1,87 +1,63 @@
 import pandas as pd
-from datetime import datetime, timedelta
+from utils import parse_bulk_orders
+from utils.sales_store import daily_sku_rollup
 
 
-def transform_sales_data(sales_data):
-    """
-    Transform Shopify sales data into a time series DataFrame
-    """
-
-    # Separate orders and line items
-    orders = [item for item in sales_data if '__parentId' not in item]
-    line_items = [item for item in sales_data if '__parentId' in item]
-
-    # Process orders
-    for order in orders:
-        order['order_tags'] = ', '.join(order['tags'])
-        order['order_date'] = datetime.strptime(order['createdAt'], "%Y-%m-%dT%H:%M:%SZ").strftime("%Y-%m-%d")
-        del order['tags']
-        del order['createdAt']
-
-    # Create past week intervals
-    past_week_intervals = []
-    today = datetime.now()
-    most_recent_sunday = today - timedelta(days=today.weekday() + 1)
-
-    # Adjust for the case when today is Sunday
-    if today.weekday() == 6:
-        most_recent_sunday = today
-
-    # Generate intervals for the past 52 complete weeks
-    for i in range(0, 52):
-        week_end = most_recent_sunday - timedelta(days=i * 7)
-        week_start = week_end - timedelta(days=6)
-        past_week_intervals.append((week_start.strftime("%Y-%m-%d"), week_end.strftime("%Y-%m-%d"), i + 1))
-
-    # Debugging: Print past week intervals
-    print("Past Week Intervals:")
-    for interval in past_week_intervals:
-        print(interval)
+WEEKDAYS = ["MON", "TUE", "WED", "THU", "FRI", "SAT", "SUN"]
 
-    # Assign weeks_ago to orders
-    for order in orders:
-        order_date = datetime.strptime(order['order_date'], "%Y-%m-%d")
-        order['weeks_ago'] = None  # Default to None
-        for week_start, week_end, weeks_ago in past_week_intervals:
-            if week_start <= order_date.strftime("%Y-%m-%d") <= week_end:
-                # Find the Sunday of the week interval
-                week_start_date = datetime.strptime(week_start, "%Y-%m-%d")
-                sunday_date = week_start_date.strftime("%b%d")
-                order['weeks_ago_string'] = f"sales_{weeks_ago}_weeks_ago_{sunday_date}"
-                break
+# Number of complete weeks of sales and the day each week ends on
+SALES_WINDOW_WEEKS = 52
+SALES_WEEK_END_DAY = "SUN"
 
-    # Convert orders and line items to DataFrames
-    orders_df = pd.DataFrame(orders)
-    line_items_df = pd.DataFrame(line_items)
 
-    # Convert quantity to integer
-    line_items_df['quantity'] = line_items_df['quantity'].astype(int)
-
-    # Rename columns
-    orders_df.rename(columns={'name': 'order_number'}, inplace=True)
-
-    # Merge orders and line items
-    line_items_and_orders = pd.merge(line_items_df, orders_df, left_on='__parentId', right_on='id', suffixes=('_line', '_order'))
+def sales_week_index(today, window_weeks=SALES_WINDOW_WEEKS, week_end_day=SALES_WEEK_END_DAY):
+    """
+    Return the last day of the most recent complete week (today itself when today is the
+    week's last day) and the week column labels, most recent week first.
+    """
+    today = pd.Timestamp(today).normalize()
+    most_recent_week_end = today - pd.Timedelta(days=(today.weekday() - WEEKDAYS.index(week_end_day)) % 7)
+    week_starts = most_recent_week_end - pd.to_timedelta([7 * i + 6 for i in range(window_weeks)], unit="D")
+    week_labels = [f"sales_{i + 1}_weeks_ago_{week_start.strftime('%b%d')}" for i, week_start in enumerate(week_starts)]
+    return most_recent_week_end, week_labels
 
-    # Create time series DataFrame
-    sales_df = line_items_and_orders.pivot_table(
-        index='sku',
-        columns='weeks_ago_string',
-        values='quantity',
-        aggfunc='sum',
-        fill_value=0
-    )
+def transform_sales_data(sales_data, window_weeks=SALES_WINDOW_WEEKS, week_end_day=SALES_WEEK_END_DAY):
+    """
+    Transform Shopify sales data into a time series DataFrame with one column per week,
+    sales_{n}_weeks_ago_{MonDD} labelled by the week's first day, most recent week first.
+    sales_data is the daily SKU rollup from the sales store (sku, order_date, quantity), the
+    (orders_df, line_items_df) tables, or raw bulk operation records.
+    """
 
-    # Keep only the past 52 weeks of columns
-    sales_columns = [f"sales_{i}_weeks_ago_" for i in range(1, 53)]
-    sales_df = sales_df[[col for col in sales_df.columns if any(col.startswith(prefix) for prefix in sales_columns)]]
+    if isinstance(sales_data, pd.DataFrame):
+        daily_sales_df = sales_data
+    else:
+        if isinstance(sales_data, tuple):
+            orders_df, line_items_df = sales_data
+        else:
+            # Parse orders and line items in a single pass; each line item carries its order's date
+            orders_df, line_items_df = parse_bulk_orders(sales_data)
+        daily_sales_df = daily_sku_rollup(line_items_df)
+
+    most_recent_week_end, week_labels = sales_week_index(pd.Timestamp.now(), window_weeks, week_end_day)
+    print(f"Sales weeks: {window_weeks} weeks ending {week_end_day}, most recent ending {most_recent_week_end.strftime('%Y-%m-%d')}")
+
+    # Bucket each day into its week by integer arithmetic, dropping days outside the window
+    days_ago = (most_recent_week_end - daily_sales_df['order_date'].dt.normalize()).dt.days.to_numpy()
+    in_window = (days_ago >= 0) & (days_ago < 7 * window_weeks)
+    windowed_sales_df = daily_sales_df[in_window]
+    weeks = pd.Categorical.from_codes(days_ago[in_window] // 7, categories=week_labels)
+
+    # Sum per SKU and week over the fixed week index, so weeks without sales are zero columns
+    sales_df = (windowed_sales_df['quantity']
+                .groupby([windowed_sales_df['sku'], weeks], observed=False)
+                .sum()
+                .unstack(fill_value=0)
+                .reindex(columns=week_labels, fill_value=0)
+                .astype('int64'))
+    sales_df.columns = pd.Index(week_labels)
 
     print(sales_df)
 
-    # Reset index to keep SKU as a column
-    sales_df.reset_index(inplace=True)
-
-    # Sort columns in descending order (most recent week first)
-    sales_df = sales_df.reindex(sorted(sales_df.columns, reverse=True), axis=1)
-
-    return sales_df
+    # Keep SKU as a column, followed by the weeks (most recent week first)
+    return sales_df.rename_axis('sku').reset_index()
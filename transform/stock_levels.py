@@ -1,60 +1,85 @@
+import base64
+import binascii
 import pandas as pd
+from utils import parse_bulk_inventory
+from utils.shiphero import SHIPHERO_WAREHOUSE_IDS
+from utils.shopify import SHOPIFY_LOCATION_IDS
 
 
-def transform_stock_levels(stock_levels_data, incoming_stock_data, committed_stock_data):
-    """
-    Transform stock levels data into a DataFrame
-    """
-
-    # Convert stock_levels_data to a DataFrame with only SKU and On Hand
-    stock_levels_df = pd.DataFrame([{
-        "SKU": product["node"]["sku"],
-        "On Hand": product["node"]["on_hand"]
-    } for product in stock_levels_data])
-
-    # Merge stock_levels_df with incoming_stock_data on SKU
-    stock_levels = stock_levels_df.merge(incoming_stock_data, how="left", left_on="SKU", right_on="sku")
-
-    # Fill NaN values in the 'incoming' column with 0
-    stock_levels = stock_levels.assign(incoming=stock_levels["incoming"].fillna(0))
-
-    # Rename the 'incoming' column to 'Incoming Stock'
-    stock_levels.rename(columns={"incoming": "Incoming Stock"}, inplace=True)
-
-    # Drop the redundant 'sku' column
-    stock_levels.drop(columns=["sku"], inplace=True)
-
-    # Create DataFrame from committed_stock_data with "id" and "sku"
-    sku_df = pd.DataFrame([{
-        "id": item["id"],
-        "sku": item["sku"]
-    } for item in committed_stock_data if "sku" in item])
-
-    # Create DataFrame from committed_stock_data with "__parentId" and "committed"
-    committed_df = pd.DataFrame([{
-        "__parentId": item["__parentId"],
-        "committed": next((q["quantity"] for q in item["quantities"] if q["name"] == "committed"), 0)
-    } for item in committed_stock_data if "quantities" in item and item["location"]["id"] == "gid://shopify/Location/71392264438"])
+def warehouse_label(warehouse_id):
+    """Short column label for a ShipHero warehouse: the numeric ID inside its base64 global ID."""
+    try:
+        return base64.b64decode(warehouse_id).decode().split(":")[-1]
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return warehouse_id
 
-    # Merge the two DataFrames on "id" and "__parentId"
-    merged_df = committed_df.merge(sku_df, how="left", left_on="__parentId", right_on="id")
 
-    # Create a DataFrame with "sku" and "committed"
-    final_committed_df = merged_df[["sku", "committed"]]
-
-    # Merge final_committed_df with stock_levels on SKU
-    stock_levels = stock_levels.merge(final_committed_df, how="left", left_on="SKU", right_on="sku")
-
-    # Fill NaN values in the 'committed' column with 0
-    stock_levels = stock_levels.assign(committed=stock_levels["committed"].fillna(0))
-
-    # Drop the redundant 'sku' column
-    stock_levels.drop(columns=["sku"], inplace=True)
-
-    # Create columns for 'Available'
-    stock_levels["Available"] = stock_levels.apply(lambda row: max(0, row["On Hand"] - row["committed"]), axis=1)
-
-    #  Create columns for 'Backorder'
-    stock_levels["Backorder"] = stock_levels.apply(lambda row: min(0, row["On Hand"] - row["committed"]), axis=1)
-
-    return stock_levels
+def transform_stock_levels(stock_levels_data, incoming_stock_data, committed_stock_data,
+                           warehouse_ids=None, location_ids=None):
+    """
+    Transform stock levels data into a DataFrame.
+    On Hand is summed over the ShipHero warehouses and committed over the Shopify locations
+    (defaults: SHIPHERO_WAREHOUSE_IDS and SHOPIFY_LOCATION_IDS). When more than one warehouse
+    or location is configured, per-warehouse "On Hand <id>" and per-location
+    "committed <name>" columns are added after the totals.
+    """
+    warehouse_ids = warehouse_ids or SHIPHERO_WAREHOUSE_IDS
+    location_ids = location_ids or SHOPIFY_LOCATION_IDS
+
+    # stock_levels_data is either the typed stock levels table or raw warehouse_products edges;
+    # products without a warehouse are from the first one
+    if isinstance(stock_levels_data, pd.DataFrame):
+        on_hand_df = pd.DataFrame({
+            "SKU": stock_levels_data["sku"],
+            "warehouse_id": stock_levels_data.get("warehouse_id", pd.Series(warehouse_ids[0], index=stock_levels_data.index)),
+            "On Hand": stock_levels_data["on_hand"].astype("int64"),
+        }).reset_index(drop=True)
+    else:
+        on_hand_df = pd.DataFrame({
+            "SKU": [product["node"]["sku"] for product in stock_levels_data],
+            "warehouse_id": [product["node"].get("warehouse_id", warehouse_ids[0]) for product in stock_levels_data],
+            "On Hand": pd.Series([product["node"]["on_hand"] or 0 for product in stock_levels_data], dtype="int64"),
+        })
+    on_hand_by_warehouse = on_hand_df.pivot_table(index="SKU", columns="warehouse_id", values="On Hand", aggfunc="sum", fill_value=0)
+    stock_levels = pd.DataFrame({"SKU": on_hand_df["SKU"].drop_duplicates()})
+    stock_levels["On Hand"] = stock_levels["SKU"].map(on_hand_by_warehouse.sum(axis=1)).fillna(0).astype("int64")
+
+    # committed_stock_data is either the compact committed table or the full bulk inventory export;
+    # the latter is parsed into inventory levels joined to their variant's SKU in a single pass
+    if isinstance(committed_stock_data, pd.DataFrame):
+        inventory_levels_df = committed_stock_data
+    else:
+        inventory_levels_df = parse_bulk_inventory(committed_stock_data)
+    inventory_levels_df = inventory_levels_df[inventory_levels_df["location_id"].isin(location_ids)]
+    committed_by_location = inventory_levels_df.pivot_table(index="sku", columns="location_id", values="committed", aggfunc="sum", fill_value=0)
+
+    # Incoming (Airtable) and committed (Shopify) quantities indexed by SKU, joined in one step
+    quantities = {
+        "Incoming Stock": incoming_stock_data.groupby("sku")["incoming"].sum(),
+        "committed": committed_by_location.sum(axis=1),
+    }
+    if len(warehouse_ids) > 1:
+        for warehouse_id in warehouse_ids:
+            quantities[f"On Hand {warehouse_label(warehouse_id)}"] = on_hand_by_warehouse.get(warehouse_id, pd.Series(dtype="int64"))
+    if len(location_ids) > 1:
+        # Columns are labelled by location name, or by numeric ID when names are missing or shared
+        location_names = inventory_levels_df.drop_duplicates("location_id").set_index("location_id")["location_name"]
+        labels = [location_names.get(location_id) or location_id.split("/")[-1] for location_id in location_ids]
+        if len(set(labels)) < len(labels):
+            labels = [location_id.split("/")[-1] for location_id in location_ids]
+        for location_id, label in zip(location_ids, labels):
+            quantities[f"committed {label}"] = committed_by_location.get(location_id, pd.Series(dtype="int64"))
+    quantities = pd.DataFrame(quantities)
+
+    stock_levels = stock_levels.join(quantities, on="SKU")
+    quantity_columns = list(quantities.columns)
+    stock_levels[quantity_columns] = stock_levels[quantity_columns].fillna(0).astype("int64")
+
+    # Available is what is left after committed orders; Backorder is the (negative) shortfall
+    net_stock = stock_levels["On Hand"] - stock_levels["committed"]
+    stock_levels["Available"] = net_stock.clip(lower=0)
+    stock_levels["Backorder"] = net_stock.clip(upper=0)
+
+    # Totals first, then the per-warehouse and per-location breakdown
+    total_columns = ["SKU", "On Hand", "Incoming Stock", "committed", "Available", "Backorder"]
+    return stock_levels[total_columns + [column for column in stock_levels.columns if column not in total_columns]].reset_index(drop=True)
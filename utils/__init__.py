@@ -10,31 +10,54 @@ from utils.export import (
 
 from utils.shiphero import (
     refresh_shiphero_token,
-    update_config_file_with_new_shiphero_token,
+    shiphero_token_store,
     is_token_expired,
     fetch_shiphero_with_throttling,
     fetch_shiphero_paginated_data,
     execute_shiphero_graphql_query,
+    get_shiphero_client,
+    fetch_shiphero_inventory_snapshot,
+    iter_inventory_snapshot_nodes,
+    parse_stock_levels,
 )
 
+from utils.tasks import run_task_graph
+
 from utils.shopify import (
+    execute_shopify_graphql_query,
+    fetch_shopify_paginated_data,
+    fetch_shopify_orders_count,
     start_bulk_operation,
     check_bulk_operation_status,
-    download_bulk_operation_results,
+    download_bulk_operation_file,
+    iter_bulk_operation_results,
     fetch_shopify_bulk_operation,
+    parse_bulk_orders,
+    parse_bulk_inventory,
 )
 
 __all__ = [
     'export_df',
     'export_json',
     'refresh_shiphero_token',
-    'update_config_file_with_new_shiphero_token',
+    'shiphero_token_store',
     'is_token_expired',
     'fetch_shiphero_with_throttling',
     'fetch_shiphero_paginated_data',
     'execute_shiphero_graphql_query',
+    'get_shiphero_client',
+    'fetch_shiphero_inventory_snapshot',
+    'iter_inventory_snapshot_nodes',
+    'parse_stock_levels',
+    'execute_shopify_graphql_query',
+    'fetch_shopify_paginated_data',
+    'fetch_shopify_orders_count',
     'start_bulk_operation',
     'check_bulk_operation_status',
-    'download_bulk_operation_results',
+    'download_bulk_operation_file',
+    'iter_bulk_operation_results',
     'fetch_shopify_bulk_operation',
+    'parse_bulk_orders',
+    'parse_bulk_inventory',
+    'run_task_graph',
 ]
@@ -0,0 +1,271 @@
+import os
+import re
+import json
+import time
+import pickle
+import hashlib
+import threading
+from contextlib import contextmanager
+from datetime import timedelta, datetime, timezone
+import pandas as pd
+import pyarrow as pa
+from utils.state import atomic_write
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; entries are then only locked between threads
+    fcntl = None
+
+
+# Fetch results are cached under cache/sources/<source>/<query hash>.arrow (DataFrames) or .pkl
+# (anything else) with a .json metadata file
+CACHE_DIR = os.path.join("cache", "sources")
+
+# Entries written with another format version are ignored (refetched) rather than misread
+CACHE_FORMAT_VERSION = 2
+
+# Compression of Arrow IPC cache files. Compressed buffers are decompressed when read;
+# with None the memory-mapped numeric columns are used without copying
+ARROW_CACHE_COMPRESSION = "zstd"
+
+
+# How long each source's cached data is fresh enough to reuse under a cache policy
+DEFAULT_CACHE_TTLS = {
+    "shiphero_stock_levels": timedelta(minutes=10),
+    "shopify_sales": timedelta(minutes=15),
+    "shopify_inventory": timedelta(minutes=10),
+    "shopify_committed_inventory": timedelta(minutes=5),
+    "airtable_incoming_stock": timedelta(minutes=15),
+    "airtable_product_metadata": timedelta(hours=1),
+}
+
+
+class CachePolicy:
+    """
+    Decides, per source, whether cached fetch results are fresh enough to reuse.
+    A source's cached data is reused when it is younger than both the source's TTL and the
+    policy-wide max_age (if set); sources listed in refresh are always fetched again.
+    Fetchers take an optional cache_policy; without one they keep their use_cache behaviour.
+    """
+
+    def __init__(self, ttls=None, max_age=None, refresh=()):
+        self.ttls = dict(DEFAULT_CACHE_TTLS, **(ttls or {}))
+        self.max_age = max_age
+        self.refresh = set(refresh)
+
+    def allowed_age(self, source):
+        """Oldest cached data that may be reused for a source."""
+        if source in self.refresh:
+            return timedelta(0)
+        ttl = self.ttls.get(source, timedelta(0))
+        return min(ttl, self.max_age) if self.max_age is not None else ttl
+
+    def is_fresh(self, source, cached_at):
+        """Whether data cached at the given epoch time may be reused for a source."""
+        return time.time() - cached_at <= self.allowed_age(source).total_seconds()
+
+    @classmethod
+    def from_args(cls, args):
+        """
+        Build a policy from request query arguments, or return None if none are given:
+          cache=ttl                 reuse sources within their default TTLs
+          cache_max_age=<seconds>   cap the age of anything reused
+          cache_ttl_<source>=<s>    override one source's TTL
+          refresh=<source>,...      always refetch these sources
+        """
+        ttls = {
+            name[len("cache_ttl_"):]: timedelta(seconds=float(value))
+            for name, value in args.items() if name.startswith("cache_ttl_")
+        }
+        max_age = args.get("cache_max_age")
+        refresh = [source for source in args.get("refresh", "").split(",") if source]
+        if args.get("cache", "").lower() != "ttl" and not ttls and max_age is None and not refresh:
+            return None
+        return cls(ttls, timedelta(seconds=float(max_age)) if max_age is not None else None, refresh)
+
+    def __repr__(self):
+        return f"CachePolicy(max_age={self.max_age}, refresh={sorted(self.refresh)})"
+
+
+def should_use_cache(source, cached_at, use_cache=False, cache_policy=None):
+    """
+    Whether a fetcher should load its cached data, written at cached_at (epoch seconds, or None
+    if there is none), instead of fetching.
+    With a cache policy the data's age decides; otherwise the fetcher's use_cache flag does.
+    """
+    if cached_at is None:
+        return False
+    if cache_policy is not None:
+        return cache_policy.is_fresh(source, cached_at)
+    return use_cache
+
+
+_entry_locks = {}
+_entry_locks_lock = threading.Lock()
+
+
+def query_hash(query=None):
+    """Stable short hash of a fetch's query (any JSON-serialisable value) for its cache key."""
+    serialised = json.dumps(query, sort_keys=True, default=str)
+    return hashlib.sha256(serialised.encode()).hexdigest()[:16]
+
+
+def is_cache_source(source):
+    """Whether source is a valid cache source name (lower-case letters, digits and underscores)."""
+    return bool(re.fullmatch(r"[a-z0-9_]+", source))
+
+
+def cache_entry_path(source, query=None, suffix=".pkl"):
+    """Path of a source/query cache entry's data (or, with another suffix, its metadata or lock) file."""
+    if not is_cache_source(source):
+        raise ValueError(f"Invalid cache source name: {source}")
+    return os.path.join(CACHE_DIR, source, query_hash(query) + suffix)
+
+
+@contextmanager
+def cache_lock(source, query=None):
+    """
+    Hold an exclusive lock on a cache entry. Threads of this process are serialised with a lock
+    per entry and other processes with an fcntl lock file, so concurrent webhook jobs fetching
+    the same source wait for one fetch and then reuse its result.
+    """
+    with file_lock(cache_entry_path(source, query, ".lock")):
+        yield
+
+
+@contextmanager
+def file_lock(lock_path):
+    """Exclusive thread and (where supported) process lock on a lock file."""
+    with _entry_locks_lock:
+        thread_lock = _entry_locks.setdefault(lock_path, threading.Lock())
+    with thread_lock:
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+        with open(lock_path, "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def read_cache(source, query=None, use_cache=False, cache_policy=None):
+    """
+    Load a cached fetch result, or return None if there is no entry or it may not be reused
+    (see should_use_cache). Callers that also write the entry should hold cache_lock.
+    """
+    try:
+        with open(cache_entry_path(source, query, ".json"), "r") as file:
+            metadata = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if metadata.get("version") != CACHE_FORMAT_VERSION:
+        return None
+
+    # The metadata's cached_at, not the file's mtime, is the entry's age
+    cached_at = datetime.fromisoformat(metadata["cached_at"]).timestamp()
+    if not should_use_cache(source, cached_at, use_cache, cache_policy):
+        return None
+    path = cache_entry_path(source, query, ".arrow" if metadata["format"] == "arrow" else ".pkl")
+    try:
+        if metadata["format"] == "arrow":
+            return read_arrow_file(path)
+        with open(path, "rb") as file:
+            return pickle.load(file)
+    except (OSError, pa.ArrowException, pickle.UnpicklingError, EOFError) as e:
+        print(f"Failed to read cache entry {path}: {e}")
+        return None
+
+
+def write_cache(source, data, query=None):
+    """
+    Atomically store a fetch result and its metadata (source, query, format, cached_at).
+    DataFrames are stored as compressed Arrow IPC files, anything else is pickled.
+    """
+    if isinstance(data, pd.DataFrame):
+        cache_format, suffix, other_suffix = "arrow", ".arrow", ".pkl"
+        atomic_write(cache_entry_path(source, query, suffix), arrow_file_bytes(data), mode="wb")
+    else:
+        cache_format, suffix, other_suffix = "pickle", ".pkl", ".arrow"
+        atomic_write(cache_entry_path(source, query, suffix), pickle.dumps(data), mode="wb")
+    atomic_write(cache_entry_path(source, query, ".json"), json.dumps({
+        "source": source,
+        "query": query,
+        "format": cache_format,
+        "version": CACHE_FORMAT_VERSION,
+        "cached_at": datetime.now(timezone.utc).isoformat()
+    }, indent=2, default=str))
+
+    # Drop the entry's file in the other format, left over if the fetch result changed type
+    other_path = cache_entry_path(source, query, other_suffix)
+    if os.path.exists(other_path):
+        os.remove(other_path)
+
+
+def arrow_file_bytes(df):
+    """Serialise a DataFrame to an Arrow IPC file (Feather v2) compressed with ARROW_CACHE_COMPRESSION."""
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    options = pa.ipc.IpcWriteOptions(compression=ARROW_CACHE_COMPRESSION)
+    with pa.ipc.new_file(sink, table.schema, options=options) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def read_arrow_file(path):
+    """
+    Read an Arrow IPC cache file through a memory map into a DataFrame. Columns are typed on disk,
+    so no per-row Python objects are rebuilt except for string columns. The file is closed before
+    returning; mapped pages the DataFrame still uses stay mapped until it is released.
+    """
+    with pa.memory_map(path, "r") as source:
+        table = pa.ipc.open_file(source).read_all()
+    return table.to_pandas(split_blocks=True)
+
+
+def cached_fetch(source, fetch, query=None, use_cache=False, cache_policy=None):
+    """
+    Return the cached result for source/query if it may be reused, otherwise call fetch() and
+    cache its result (None results are not cached). The entry is locked throughout, so a job
+    arriving while another fetches the same entry waits and reuses that fetch when fresh.
+    """
+    with cache_lock(source, query):
+        data = read_cache(source, query, use_cache, cache_policy)
+        if data is not None:
+            print(f"Loading cached {source} data...")
+            return data
+        data = fetch()
+        if data is not None:
+            write_cache(source, data, query)
+        return data
+
+
+def invalidate_cache(source=None, query=None):
+    """
+    Remove cached fetch results: one entry when a query is given, every entry of a source,
+    or (with no source) every entry. Returns the number of entries removed.
+    """
+    if source is None:
+        sources = os.listdir(CACHE_DIR) if os.path.isdir(CACHE_DIR) else []
+        return sum(invalidate_cache(name) for name in sources)
+
+    if query is not None:
+        hashes = [query_hash(query)]
+    else:
+        source_dir = os.path.dirname(cache_entry_path(source))
+        names = os.listdir(source_dir) if os.path.isdir(source_dir) else []
+        hashes = [name[:-len(".json")] for name in names if name.endswith(".json")]
+
+    removed = 0
+    for entry_hash in hashes:
+        path = os.path.join(CACHE_DIR, source, entry_hash)
+        with file_lock(path + ".lock"):
+            if os.path.exists(path + ".json"):
+                removed += 1
+            for suffix in (".pkl", ".arrow", ".json"):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+    print(f"Invalidated {removed} cached {source} entries")
+    return removed
@@ -0,0 +1,195 @@
+import io
+import os
+import json
+import shutil
+import threading
+import pandas as pd
+from datetime import datetime, timedelta, timezone
+from utils.state import atomic_write
+from utils.shopify import parse_bulk_orders
+
+
+SALES_STORE_DIR = "cache/shopify_sales"
+SALES_STORE_WINDOW_WEEKS = 53
+
+# Parquet compression of the store's tables; files are read through a memory map
+SALES_STORE_COMPRESSION = "zstd"
+
+
+def week_start(timestamps):
+    """Return the Monday (UTC midnight) starting the week of each timestamp in a datetime Series."""
+    days = timestamps.dt.tz_convert("UTC").dt.normalize()
+    return days - pd.to_timedelta(days.dt.weekday, unit="D")
+
+
+def daily_sku_rollup(line_items_df):
+    """Sum line item quantities per SKU and order date (UTC)."""
+    order_dates = line_items_df["created_at"].dt.tz_convert("UTC").dt.tz_localize(None).dt.normalize()
+    return (line_items_df.assign(order_date=order_dates)
+            .groupby(["sku", "order_date"], as_index=False)["quantity"].sum())
+
+
+class SalesStore:
+    """
+    Week-partitioned Parquet store of Shopify orders and line items.
+    Each week (starting Monday, by order creation date) is a directory holding orders.parquet and
+    line_items.parquet. A manifest records the partitions and the newest order's creation time
+    (the high-water mark), so incremental fetches neither read nor rewrite old weeks, and the
+    start time of the last complete sync (the watermark for updated_at delta syncs).
+    Upserts replace orders by order_id; partitions older than the window are evicted.
+    Each partition also keeps a daily SKU rollup (daily_sku.parquet), rebuilt whenever the
+    partition is written, so sales aggregates only reprocess the weeks that changed.
+    """
+
+    def __init__(self, directory=SALES_STORE_DIR, window_weeks=SALES_STORE_WINDOW_WEEKS):
+        self.directory = directory
+        self.window_weeks = window_weeks
+        self.lock = threading.Lock()
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.directory, "manifest.json")
+
+    def load_manifest(self):
+        """Return the manifest, or an empty one if the store has not been written yet."""
+        if not os.path.exists(self.manifest_path):
+            return {"high_water_mark": None, "synced_at": None, "partitions": []}
+        with open(self.manifest_path, "r") as f:
+            return json.load(f)
+
+    def save_manifest(self, manifest):
+        atomic_write(self.manifest_path, json.dumps(manifest, indent=2))
+
+    def is_empty(self):
+        return not self.load_manifest()["partitions"]
+
+    @property
+    def high_water_mark(self):
+        """Creation time of the newest stored order, or None for an empty store."""
+        high_water_mark = self.load_manifest()["high_water_mark"]
+        return datetime.fromisoformat(high_water_mark) if high_water_mark else None
+
+    @property
+    def sync_watermark(self):
+        """Start time of the last sync that brought the store fully up to date, or None."""
+        synced_at = self.load_manifest().get("synced_at")
+        return datetime.fromisoformat(synced_at) if synced_at else None
+
+    def set_sync_watermark(self, synced_at):
+        with self.lock:
+            manifest = self.load_manifest()
+            manifest["synced_at"] = synced_at.isoformat()
+            self.save_manifest(manifest)
+
+    def partition_path(self, partition, table):
+        return os.path.join(self.directory, f"week={partition}", f"{table}.parquet")
+
+    def read_partition(self, partition):
+        """Read one week's (orders_df, line_items_df)."""
+        return (pd.read_parquet(self.partition_path(partition, "orders"), memory_map=True),
+                pd.read_parquet(self.partition_path(partition, "line_items"), memory_map=True))
+
+    def write_partition(self, partition, orders_df, line_items_df):
+        tables = (("orders", orders_df), ("line_items", line_items_df), ("daily_sku", daily_sku_rollup(line_items_df)))
+        for table, df in tables:
+            buffer = io.BytesIO()
+            df.reset_index(drop=True).to_parquet(buffer, index=False, compression=SALES_STORE_COMPRESSION)
+            atomic_write(self.partition_path(partition, table), buffer.getvalue(), "wb")
+
+    def upsert(self, orders_df, line_items_df):
+        """
+        Insert or replace orders (and all of their line items) by order_id.
+        Only the partitions of the weeks the given orders were created in are rewritten.
+        """
+        if orders_df.empty:
+            return
+
+        with self.lock:
+            manifest = self.load_manifest()
+            partitions = set(manifest["partitions"])
+            order_weeks = week_start(orders_df["created_at"]).dt.strftime("%Y-%m-%d")
+            line_item_weeks = week_start(line_items_df["created_at"]).dt.strftime("%Y-%m-%d")
+
+            for partition in sorted(order_weeks.unique()):
+                new_orders = orders_df[order_weeks == partition]
+                new_line_items = line_items_df[line_item_weeks == partition]
+                if partition in partitions:
+                    stored_orders, stored_line_items = self.read_partition(partition)
+                    kept_orders = stored_orders[~stored_orders["order_id"].isin(new_orders["order_id"])]
+                    kept_line_items = stored_line_items[~stored_line_items["order_id"].isin(new_orders["order_id"])]
+                    new_orders = pd.concat([kept_orders, new_orders], ignore_index=True)
+                    new_line_items = pd.concat([kept_line_items, new_line_items], ignore_index=True)
+                self.write_partition(partition, new_orders, new_line_items)
+                partitions.add(partition)
+
+            newest = orders_df["created_at"].max().to_pydatetime()
+            if manifest["high_water_mark"] is None or newest > datetime.fromisoformat(manifest["high_water_mark"]):
+                manifest["high_water_mark"] = newest.isoformat()
+            manifest["partitions"] = sorted(partitions)
+            self.save_manifest(manifest)
+        print(f"Upserted {len(orders_df)} orders into {order_weeks.nunique()} weekly sales partitions")
+
+    def delete(self, orders_df):
+        """Remove the given orders (located by their order_id and created_at) and their line items."""
+        if orders_df.empty:
+            return
+
+        with self.lock:
+            manifest = self.load_manifest()
+            order_weeks = week_start(orders_df["created_at"]).dt.strftime("%Y-%m-%d")
+            removed = 0
+            for partition in sorted(set(order_weeks.unique()) & set(manifest["partitions"])):
+                order_ids = orders_df.loc[order_weeks == partition, "order_id"]
+                stored_orders, stored_line_items = self.read_partition(partition)
+                deleted = stored_orders["order_id"].isin(order_ids)
+                if deleted.any():
+                    removed += deleted.sum()
+                    self.write_partition(partition, stored_orders[~deleted],
+                                         stored_line_items[~stored_line_items["order_id"].isin(order_ids)])
+        print(f"Removed {removed} orders from the sales store")
+
+    def evict(self, now=None):
+        """Drop the partitions of weeks that started before the window."""
+        now = now or datetime.now(timezone.utc)
+        cutoff = (now - timedelta(weeks=self.window_weeks)).strftime("%Y-%m-%d")
+        with self.lock:
+            manifest = self.load_manifest()
+            expired = [partition for partition in manifest["partitions"] if partition < cutoff]
+            if not expired:
+                return
+            manifest["partitions"] = [partition for partition in manifest["partitions"] if partition >= cutoff]
+            self.save_manifest(manifest)
+            for partition in expired:
+                shutil.rmtree(os.path.join(self.directory, f"week={partition}"), ignore_errors=True)
+        print(f"Evicted {len(expired)} weekly sales partitions older than {cutoff}")
+
+    def load(self):
+        """Read every partition into (orders_df, line_items_df)."""
+        partitions = self.load_manifest()["partitions"]
+        if not partitions:
+            return parse_bulk_orders([])
+        tables = [self.read_partition(partition) for partition in partitions]
+        return (pd.concat([orders for orders, _ in tables], ignore_index=True),
+                pd.concat([line_items for _, line_items in tables], ignore_index=True))
+
+    def read_daily_rollup(self, partition):
+        """Read one week's daily SKU rollup, building it for partitions written without one."""
+        path = self.partition_path(partition, "daily_sku")
+        if not os.path.exists(path):
+            _, line_items_df = self.read_partition(partition)
+            buffer = io.BytesIO()
+            daily_sku_rollup(line_items_df).to_parquet(buffer, index=False, compression=SALES_STORE_COMPRESSION)
+            atomic_write(path, buffer.getvalue(), "wb")
+        return pd.read_parquet(path, memory_map=True)
+
+    def load_daily_rollup(self):
+        """Read the daily SKU rollup of every partition: one row per sku and order_date with the quantity sold."""
+        partitions = self.load_manifest()["partitions"]
+        if not partitions:
+            return daily_sku_rollup(parse_bulk_orders([])[1])
+        return pd.concat([self.read_daily_rollup(partition) for partition in partitions], ignore_index=True)
+
+    def clear(self):
+        """Remove every partition and the manifest."""
+        with self.lock:
+            shutil.rmtree(self.directory, ignore_errors=True)
@@ -1,8 +1,111 @@
 import requests
 import os
+import json
+import pickle
+import hashlib
 import time
+import random
+import threading
+import ijson
+import pandas as pd
+from requests.adapters import HTTPAdapter
 from datetime import datetime, timedelta
+import config
 from config import SHIPHERO_API_TOKEN, SHIPHERO_REFRESH_TOKEN, SHIPHERO_REFRESH_ENDPOINT, SHIPHERO_GRAPHQL_ENDPOINT, SHIPHERO_TOKEN_EXPIRATION
+from utils.state import load_state, save_state
+from utils.cache import file_lock
+
+# ShipHero meters the GraphQL API with a per-account credit bucket. The defaults match the
+# standard account limits and can be overridden in config.py for accounts with other limits.
+SHIPHERO_CREDIT_CAPACITY = getattr(config, "SHIPHERO_CREDIT_CAPACITY", 2002)
+SHIPHERO_CREDIT_REFILL_RATE = getattr(config, "SHIPHERO_CREDIT_REFILL_RATE", 60)  # credits per second
+
+# Cost assumed for a query whose complexity has not been observed yet
+SHIPHERO_DEFAULT_QUERY_COST = 101
+
+# Complexity paginated fetches aim for per page, and the largest page size they will request
+SHIPHERO_TARGET_PAGE_COMPLEXITY = getattr(config, "SHIPHERO_TARGET_PAGE_COMPLEXITY", SHIPHERO_CREDIT_CAPACITY // 2)
+SHIPHERO_MAX_PAGE_SIZE = 500
+
+# Pagination checkpoints older than this are discarded rather than resumed
+SHIPHERO_CHECKPOINT_MAX_AGE = timedelta(minutes=getattr(config, "SHIPHERO_CHECKPOINT_MAX_AGE_MINUTES", 30))
+
+# Warehouses whose stock levels are fetched (in parallel); defaults to the single configured warehouse
+SHIPHERO_WAREHOUSE_IDS = getattr(config, "SHIPHERO_WAREHOUSE_IDS", [config.SHIPHERO_WAREHOUSE_ID])
+
+
+class ShipHeroCreditBucket:
+    """
+    Client-side model of the ShipHero credit bucket.
+    Requests reserve their expected complexity before they are sent and settle the reservation
+    with the complexity ShipHero reports, so requests are spaced to the refill rate instead of
+    running into throttling errors and waiting out the full penalty.
+    """
+
+    def __init__(self, capacity=SHIPHERO_CREDIT_CAPACITY, refill_rate=SHIPHERO_CREDIT_REFILL_RATE):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.credits = float(capacity)
+        self.updated_at = time.monotonic()
+        self.query_costs = {}
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.credits = min(self.capacity, self.credits + (now - self.updated_at) * self.refill_rate)
+        self.updated_at = now
+
+    def record(self, query, complexity, page_size=None):
+        """Remember the complexity of a query and the page size it was observed at."""
+        self.query_costs[query] = (complexity, page_size)
+
+    def estimate(self, query, page_size=None):
+        """Return the expected cost of a query, scaled from its last observed complexity to the page size."""
+        if query not in self.query_costs:
+            return SHIPHERO_DEFAULT_QUERY_COST
+        complexity, observed_page_size = self.query_costs[query]
+        if page_size and observed_page_size:
+            return complexity * page_size / observed_page_size
+        return complexity
+
+    def acquire(self, cost):
+        """Block until enough credits are available for the request, then reserve them."""
+        cost = min(cost, self.capacity)
+        while True:
+            with self._lock:
+                self._refill()
+                if self.credits >= cost:
+                    self.credits -= cost
+                    return cost
+                wait_time = (cost - self.credits) / self.refill_rate
+            time.sleep(wait_time)
+
+    def settle(self, query, reserved, complexity, page_size=None):
+        """Replace a reservation with the complexity ShipHero actually charged."""
+        with self._lock:
+            self._refill()
+            self.credits = min(self.capacity, self.credits + reserved - complexity)
+            self.record(query, complexity, page_size)
+
+    def sync(self, remaining_credits):
+        """Align the local bucket with the remaining credits reported by ShipHero."""
+        with self._lock:
+            self._refill()
+            self.credits = min(self.capacity, float(remaining_credits))
+
+
+# Shared by every ShipHero caller in the process, including concurrent webhook threads
+shiphero_credit_bucket = ShipHeroCreditBucket()
+
+
+def get_response_complexity(result):
+    """Sum the complexity reported by each operation in a ShipHero GraphQL response."""
+    data = result.get("data") or {}
+    return sum(
+        operation.get("complexity") or 0
+        for operation in data.values()
+        if isinstance(operation, dict)
+    )
 
 
 def refresh_shiphero_token():
@@ -13,7 +116,7 @@ def refresh_shiphero_token():
     data = {
         "refresh_token": SHIPHERO_REFRESH_TOKEN
     }
-    response = requests.post(SHIPHERO_REFRESH_ENDPOINT, json=data, headers=headers)
+    response = requests.post(SHIPHERO_REFRESH_ENDPOINT, json=data, headers=headers, timeout=(5, 30))
     if response.status_code == 200:
         response_data = response.json()
         new_token = response_data.get("access_token")
@@ -21,93 +124,324 @@ def refresh_shiphero_token():
         if new_token and expires_in:
             expiration_time = datetime.now() + timedelta(seconds=expires_in)
             print("ShipHero API token refreshed successfully.")
-            update_config_file_with_new_shiphero_token(new_token, expiration_time)
             return new_token, expiration_time
     print("Failed to refresh ShipHero API token.")
     return None, None
 
-def update_config_file_with_new_shiphero_token(new_token, expiration_time):
-    """Update the config.py file with a new ShipHero API token."""
-    config_file_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'config.py'))
-    with open(config_file_path, 'r') as file:
-        lines = file.readlines()
-    
-    with open(config_file_path, 'w') as file:
-        for line in lines:
-            if line.startswith('SHIPHERO_API_TOKEN'):
-                file.write(f'SHIPHERO_API_TOKEN = "{new_token}"\n')
-            elif line.startswith('SHIPHERO_TOKEN_EXPIRATION'):
-                file.write(f'SHIPHERO_TOKEN_EXPIRATION = "{expiration_time.isoformat()}"\n')
-            else:
-                file.write(line)
+
+class ShipHeroTokenStore:
+    """
+    Process-wide ShipHero access token.
+    The token is refreshed under a lock shortly before it expires, so concurrent webhook threads
+    trigger a single refresh, and it is persisted to a small state file instead of config.py.
+    """
+
+    def __init__(self, state_name="shiphero_token", refresh_margin=timedelta(minutes=10)):
+        self.state_name = state_name
+        self.refresh_margin = refresh_margin
+        self._lock = threading.Lock()
+
+        # Start from whichever token lasts longer: the persisted one or the one in config.py
+        self.token = SHIPHERO_API_TOKEN
+        self.expiration = datetime.fromisoformat(SHIPHERO_TOKEN_EXPIRATION)
+        state = load_state(state_name)
+        if state and state.get("access_token") and state.get("expiration"):
+            expiration = datetime.fromisoformat(state["expiration"])
+            if expiration > self.expiration:
+                self.token = state["access_token"]
+                self.expiration = expiration
+
+    def is_expired(self):
+        """Check if the token has expired."""
+        return datetime.now() >= self.expiration
+
+    def _refresh(self):
+        new_token, new_expiration = refresh_shiphero_token()
+        if not new_token:
+            raise Exception("Failed to refresh ShipHero API token.")
+        self.token = new_token
+        self.expiration = new_expiration
+        save_state(self.state_name, {
+            "access_token": new_token,
+            "expiration": new_expiration.isoformat()
+        })
+
+    def get_token(self):
+        """Return a valid token, refreshing it first if it expires within the refresh margin."""
+        with self._lock:
+            if datetime.now() >= self.expiration - self.refresh_margin:
+                print("Token is about to expire. Refreshing token...")
+                self._refresh()
+            return self.token
+
+    def refresh_rejected_token(self, rejected_token):
+        """Refresh after ShipHero rejected a token, unless another thread already replaced it."""
+        with self._lock:
+            if self.token == rejected_token:
+                print("Token was rejected by ShipHero. Refreshing token...")
+                self._refresh()
+            return self.token
+
+
+shiphero_token_store = ShipHeroTokenStore()
+
 
 def is_token_expired():
     """Check if the ShipHero API token has expired."""
-    expiration_time = datetime.fromisoformat(SHIPHERO_TOKEN_EXPIRATION)
-    return datetime.now() >= expiration_time
+    return shiphero_token_store.is_expired()
+
+class ShipHeroAPIError(requests.exceptions.RequestException):
+    """Raised when ShipHero keeps answering with a non-200 response after retries."""
+
+
+class ShipHeroClient:
+    """
+    Reusable ShipHero GraphQL client.
+    Keeps a pooled keep-alive session so pages and mutations reuse connections instead of paying
+    a TLS handshake per request, applies timeouts, retries transient failures with jittered
+    exponential backoff, and paces queries through the shared credit bucket.
+    """
+
+    # Statuses that are worth retrying; 429 means the request was rejected before being processed
+    RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+    def __init__(self, endpoint=SHIPHERO_GRAPHQL_ENDPOINT, credit_bucket=shiphero_credit_bucket, token_store=shiphero_token_store,
+                 timeout=(5, 60), max_retries=4, backoff_base=1.0, backoff_max=30.0, pool_size=10):
+        self.endpoint = endpoint
+        self.credit_bucket = credit_bucket
+        self.token_store = token_store
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "Content-Type": "application/json",
+            "Accept-Encoding": "gzip, deflate",
+        })
+
+    def _backoff(self, attempt):
+        """Sleep for a full-jitter exponential backoff interval."""
+        wait_time = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        print(f"Retrying ShipHero request in {wait_time:.1f} seconds (attempt {attempt + 1}/{self.max_retries})...")
+        time.sleep(wait_time)
+
+    def post(self, payload, idempotent=True):
+        """
+        POST a GraphQL payload, retrying transient failures.
+        Non-idempotent requests (mutations) are only retried when ShipHero cannot have processed
+        them: connect timeouts and 429 responses.
+        """
+        token_refreshed = False
+        attempt = 0
+        while True:
+            can_retry = attempt < self.max_retries
+            token = self.token_store.get_token()
+            try:
+                response = self.session.post(self.endpoint, json=payload, headers={"Authorization": f"Bearer {token}"}, timeout=self.timeout)
+            except requests.exceptions.ConnectTimeout:
+                if not can_retry:
+                    raise
+                self._backoff(attempt)
+                attempt += 1
+                continue
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if not (can_retry and idempotent):
+                    raise
+                self._backoff(attempt)
+                attempt += 1
+                continue
+
+            if response.status_code == 401 and not token_refreshed:
+                # The token was revoked or expired early; a rejected request was not processed
+                self.token_store.refresh_rejected_token(token)
+                token_refreshed = True
+                continue
+
+            if response.status_code in self.RETRY_STATUS_CODES and can_retry and (idempotent or response.status_code == 429):
+                print(f"ShipHero responded with status {response.status_code}")
+                self._backoff(attempt)
+                attempt += 1
+                continue
+            return response
+
+    def execute(self, query, variables=None, idempotent=True):
+        """Execute a GraphQL query or mutation with credit pacing and throttle handling."""
+        page_size = (variables or {}).get("first")
+        while True:
+            # Wait for the credits this query is expected to cost before sending it
+            reserved = self.credit_bucket.acquire(self.credit_bucket.estimate(query, page_size))
+            response = self.post({"query": query, "variables": variables}, idempotent=idempotent)
+
+            if response.status_code == 200:
+                result = response.json()
+                # Print the result for debugging purposes
+                print(result)
+
+                if "errors" in result:
+                    error = result["errors"][0]
+                    if error.get("code") == 30:
+                        # The local bucket drifted from ShipHero's; resync and let acquire() pace the retry
+                        required_credits = error.get("required_credits")
+                        remaining_credits = error.get("remaining_credits")
+                        if required_credits is not None and remaining_credits is not None:
+                            print(f"Throttling detected. Resyncing credit bucket ({remaining_credits} credits remaining, {required_credits} required)...")
+                            self.credit_bucket.sync(remaining_credits)
+                            self.credit_bucket.record(query, required_credits, page_size)
+                        else:
+                            wait_time_str = error["time_remaining"]
+                            wait_time = int(wait_time_str.split()[0])
+                            print(f"Throttling detected. Waiting for {wait_time} seconds before retrying...")
+                            time.sleep(wait_time)
+                        continue
+
+                self.credit_bucket.settle(query, reserved, get_response_complexity(result), page_size)
+                return result
+            else:
+                print("Failed to fetch data")
+                print(response.text)
+                raise ShipHeroAPIError(f"Failed to fetch data from ShipHero API (status {response.status_code})", response=response)
+
+
+_shiphero_client = None
+_shiphero_client_lock = threading.Lock()
+
+
+def get_shiphero_client():
+    """Return the process-wide ShipHero client, creating it on first use."""
+    global _shiphero_client
+    with _shiphero_client_lock:
+        if _shiphero_client is None:
+            _shiphero_client = ShipHeroClient()
+        return _shiphero_client
 
 def fetch_shiphero_with_throttling(query, variables):
     """Fetch data from ShipHero with automatic token refresh and throttle handling."""
-    global SHIPHERO_API_TOKEN, SHIPHERO_TOKEN_EXPIRATION
+    return get_shiphero_client().execute(query, variables)
 
-    if is_token_expired():
-        print("Token is expired. Refreshing token...")
-        new_token, new_expiration = refresh_shiphero_token()
-        if not new_token:
-            raise Exception("Failed to refresh ShipHero API token.")
-        SHIPHERO_API_TOKEN = new_token
-        SHIPHERO_TOKEN_EXPIRATION = new_expiration.isoformat()
-    
-    headers = {
-        "Authorization": f"Bearer {SHIPHERO_API_TOKEN}",
-        "Content-Type": "application/json"
-    }
-    
-    while True:
-        response = requests.post(SHIPHERO_GRAPHQL_ENDPOINT, json={"query": query, "variables": variables}, headers=headers)
-        
-        if response.status_code == 200:
-            result = response.json()
-            # Print the result for debugging purposes
-            print(result)
-            
-            if "errors" in result:
-                error = result["errors"][0]
-                if error["code"] == 30:
-                    wait_time_str = error["time_remaining"]
-                    wait_time = int(wait_time_str.split()[0])
-                    print(f"Throttling detected. Waiting for {wait_time} seconds before retrying...")
-                    time.sleep(wait_time)
-                    continue
-            return result
-        else:
-            print("Failed to fetch data")
-            print(response.text)
-            raise Exception("Failed to fetch data from ShipHero API")
+def next_page_size(complexity, page_size, target_complexity=SHIPHERO_TARGET_PAGE_COMPLEXITY, max_page_size=SHIPHERO_MAX_PAGE_SIZE):
+    """Size the next page so its complexity approaches the target, based on the last page's complexity."""
+    if not complexity or not page_size:
+        return page_size
+    cost_per_edge = complexity / page_size
+    return max(1, min(max_page_size, int(target_complexity // cost_per_edge)))
+
+def pagination_checkpoint_key(query, variables):
+    """Identify a paginated fetch by its query and variables, ignoring the cursor and page size."""
+    stable_variables = {key: value for key, value in variables.items() if key not in ("after", "first")}
+    payload = json.dumps({"query": query, "variables": stable_variables}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def load_pagination_checkpoint(path, key):
+    """
+    Load the pages saved by an interrupted paginated fetch.
+    The checkpoint is a header followed by one pickled record per page; a record cut short by a
+    crash ends the checkpoint. Returns (edges, end_cursor, page_size), or None if there is no
+    checkpoint for this query. A checkpoint older than SHIPHERO_CHECKPOINT_MAX_AGE is deleted
+    instead, since stock has moved since its pages were fetched.
+    """
+    if not os.path.exists(path):
+        return None
+
+    edges = []
+    end_cursor = None
+    page_size = None
+    with open(path, 'rb') as f:
+        try:
+            header = pickle.load(f)
+        except (EOFError, pickle.UnpicklingError):
+            return None
+        if header.get("key") != key:
+            return None
+        created_at = header.get("created_at")
+        stale = created_at is None or time.time() - created_at > SHIPHERO_CHECKPOINT_MAX_AGE.total_seconds()
+        while not stale:
+            try:
+                page = pickle.load(f)
+            except (EOFError, pickle.UnpicklingError):
+                break
+            edges.extend(page["edges"])
+            end_cursor = page["end_cursor"]
+            page_size = page["page_size"]
+
+    if stale:
+        print(f"Discarding stale pagination checkpoint {path}")
+        os.remove(path)
+        return None
+    if end_cursor is None:
+        return None
+    return edges, end_cursor, page_size
+
+def fetch_shiphero_paginated_data(query, variables, data_key, target_complexity=SHIPHERO_TARGET_PAGE_COMPLEXITY, max_page_size=SHIPHERO_MAX_PAGE_SIZE, checkpoint_name=None):
+    """
+    Fetch paginated data from ShipHero GraphQL API.
+    variables["first"] is the initial page size; later pages are resized from the complexity
+    ShipHero reports so each round trip pulls as many edges as target_complexity allows.
+    With a checkpoint_name, every page is appended to cache/checkpoints/<checkpoint_name>.pkl as
+    it arrives, and a fetch of the same query that failed partway resumes from its last cursor
+    instead of re-spending credits on the pages it already has. The checkpoint is removed once
+    the last page has been fetched, and is locked for the whole fetch so concurrent jobs using
+    the same checkpoint_name take turns instead of appending to the same file.
+    """
+    if not checkpoint_name:
+        return _fetch_shiphero_pages(query, variables, data_key, target_complexity, max_page_size)
 
-def fetch_shiphero_paginated_data(query, variables, data_key):
-    """Fetch paginated data from ShipHero GraphQL API."""
+    checkpoint_path = os.path.join("cache", "checkpoints", f"{checkpoint_name}.pkl")
+    with file_lock(checkpoint_path + ".lock"):
+        return _fetch_shiphero_pages(query, variables, data_key, target_complexity, max_page_size, checkpoint_name, checkpoint_path)
+
+def _fetch_shiphero_pages(query, variables, data_key, target_complexity, max_page_size, checkpoint_name=None, checkpoint_path=None):
+    """Page through a ShipHero query, checkpointing to checkpoint_path if given (see fetch_shiphero_paginated_data)."""
     data_list = []
     has_next_page = True
     after_cursor = None
 
+    if checkpoint_path:
+        checkpoint_key = pagination_checkpoint_key(query, variables)
+        checkpoint = load_pagination_checkpoint(checkpoint_path, checkpoint_key)
+        if checkpoint:
+            data_list, after_cursor, variables["first"] = checkpoint
+            print(f"Resuming {checkpoint_name} from checkpoint with {len(data_list)} records")
+        else:
+            os.makedirs(os.path.dirname(checkpoint_path), exist_ok=True)
+            with open(checkpoint_path, 'wb') as f:
+                pickle.dump({"key": checkpoint_key, "created_at": time.time()}, f)
+
     while has_next_page:
         variables["after"] = after_cursor
         # print(f"Sending request with variables: {variables}")
         result = fetch_shiphero_with_throttling(query, variables)
         
         if result:
-            data = result.get("data", {}).get(data_key, {}).get("data", {})
+            data = (result.get("data") or {}).get(data_key, {}).get("data", {})
             if data and "edges" in data:
                 data_list.extend(data["edges"])
-                page_info = result.get("data", {}).get(data_key, {}).get("data", {}).get("pageInfo")
+                page_size = variables.get("first")
+                complexity = result["data"][data_key].get("complexity")
+                page_info = data.get("pageInfo")
                 if page_info:
                     has_next_page = page_info.get("hasNextPage", False)
                     after_cursor = page_info.get("endCursor")
+                    if checkpoint_path and has_next_page:
+                        with open(checkpoint_path, 'ab') as f:
+                            pickle.dump({"edges": data["edges"], "end_cursor": after_cursor, "page_size": page_size}, f)
                 else:
                     print("No 'pageInfo' found in the response")
                     print("Response data:", result)
                     has_next_page = False
+
+                next_size = next_page_size(complexity, page_size, target_complexity, max_page_size)
+                if next_size != page_size:
+                    print(f"Adjusting page size from {page_size} to {next_size} (complexity {complexity})")
+                    variables["first"] = next_size
+            elif "errors" in result:
+                # Keep the checkpoint so the next run resumes from the last good page
+                print("Response data:", result)
+                raise ShipHeroAPIError(f"ShipHero returned errors while fetching {data_key}: {result['errors']}")
             else:
                 print("No data found in the response or 'edges' key is missing")
                 print("Response data:", result)
@@ -116,19 +450,124 @@ def fetch_shiphero_paginated_data(query, variables, data_key):
             print("Failed to fetch data")
             has_next_page = False
 
+    if checkpoint_path and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
     return data_list
 
 def execute_shiphero_graphql_query(query):
-    """Execute a GraphQL query against ShipHero and return the response."""
-    url = "https://public-api.shiphero.com/graphql"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {SHIPHERO_API_TOKEN}"
-    }
+    """Execute a GraphQL query payload (e.g. a mutation) against ShipHero and return the response."""
     print("Executing GraphQL query:")
     print(query)
-    response = requests.post(url, json=query, headers=headers)
-    print("Response status code:", response.status_code)
-    print("Response content:", response.content)
-    response.raise_for_status()
-    return response.json()
+    response = get_shiphero_client().execute(query["query"], query.get("variables"), idempotent=False)
+    return response
+
+def generate_inventory_snapshot(warehouse_id):
+    """Request an asynchronous inventory snapshot for a warehouse and return the snapshot record."""
+    mutation = """
+    mutation ($warehouse_id: String!) {
+      inventory_generate_snapshot(data: {warehouse_id: $warehouse_id, new_format: true}) {
+        request_id
+        complexity
+        snapshot {
+          snapshot_id
+          status
+          error
+        }
+      }
+    }
+    """
+    result = get_shiphero_client().execute(mutation, {"warehouse_id": warehouse_id}, idempotent=False)
+    return (result.get("data") or {}).get("inventory_generate_snapshot", {}).get("snapshot")
+
+def check_inventory_snapshot_status(snapshot_id):
+    """Check the status of an inventory snapshot."""
+    query = """
+    query ($snapshot_id: String!) {
+      inventory_snapshot(snapshot_id: $snapshot_id) {
+        request_id
+        complexity
+        snapshot {
+          snapshot_id
+          status
+          error
+          snapshot_url
+          snapshot_expiration
+        }
+      }
+    }
+    """
+    result = get_shiphero_client().execute(query, {"snapshot_id": snapshot_id})
+    return (result.get("data") or {}).get("inventory_snapshot", {}).get("snapshot")
+
+def download_inventory_snapshot(url, path):
+    """Stream an inventory snapshot file to disk in chunks."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial_path = f"{path}.part"
+    with requests.get(url, stream=True, timeout=(5, 300)) as response:
+        response.raise_for_status()
+        with open(partial_path, 'wb') as file:
+            for chunk in response.iter_content(chunk_size=1024 * 1024):
+                file.write(chunk)
+    os.replace(partial_path, path)
+    return path
+
+def iter_inventory_snapshot_nodes(path):
+    """
+    Stream-parse a downloaded inventory snapshot into warehouse_products-style edges.
+    Yields {"node": {"sku", "on_hand", "allocated", "available", "backorder"}} per product, summing
+    the warehouse entries of the product (a snapshot generated for one warehouse has a single entry).
+    """
+    with open(path, 'rb') as file:
+        for sku, product in ijson.kvitems(file, "products"):
+            warehouse_products = product.get("warehouse_products") or product.get("warehouses") or {}
+            levels = [level for level in warehouse_products.values() if level.get("active", True)]
+            if not levels:
+                continue
+            yield {"node": {
+                "sku": product.get("sku") or sku,
+                "on_hand": sum(int(level.get("on_hand") or 0) for level in levels),
+                "allocated": sum(int(level.get("allocated") or 0) for level in levels),
+                "available": sum(int(level.get("available") or 0) for level in levels),
+                "backorder": sum(int(level.get("backorder") or 0) for level in levels),
+            }}
+
+def parse_stock_levels(products):
+    """
+    Build a typed stock levels table from warehouse_products-style edges ({"node": {...}}).
+    Returns:
+      pandas.DataFrame: One row per product with sku and the on_hand, allocated, available and
+      backorder quantities (int64, missing quantities as 0).
+    """
+    quantity_names = ("on_hand", "allocated", "available", "backorder")
+    nodes = [product["node"] for product in products]
+    stock_levels = {"sku": [node["sku"] for node in nodes]}
+    for name in quantity_names:
+        stock_levels[name] = pd.Series([node.get(name) or 0 for node in nodes], dtype="int64")
+    return pd.DataFrame(stock_levels)
+
+def fetch_shiphero_inventory_snapshot(warehouse_id, path, poll_interval=5, max_poll_interval=30, timeout=1800):
+    """Generate an inventory snapshot, wait for it to finish and download it to path."""
+    snapshot = generate_inventory_snapshot(warehouse_id)
+    if not snapshot:
+        raise ShipHeroAPIError("Failed to request ShipHero inventory snapshot")
+
+    snapshot_id = snapshot["snapshot_id"]
+    print(f"Requested inventory snapshot {snapshot_id}")
+    deadline = time.monotonic() + timeout
+
+    while True:
+        snapshot = check_inventory_snapshot_status(snapshot_id)
+        status = (snapshot or {}).get("status")
+
+        if status == "success":
+            print("Inventory snapshot completed")
+            return download_inventory_snapshot(snapshot["snapshot_url"], path)
+        elif status in ("error", "aborted"):
+            raise ShipHeroAPIError(f"Inventory snapshot {snapshot_id} {status}: {snapshot.get('error')}")
+        elif time.monotonic() >= deadline:
+            raise ShipHeroAPIError(f"Inventory snapshot {snapshot_id} did not finish within {timeout} seconds")
+
+        print(f"Inventory snapshot status: {status}")
+        time.sleep(poll_interval)
+        poll_interval = min(max_poll_interval, poll_interval * 1.5)
@@ -1,7 +1,42 @@
 import requests
+import os
+import re
 import time
-import json
+import hmac
+import base64
+import hashlib
+import threading
+import orjson
+import pandas as pd
+from datetime import datetime, timedelta, timezone
+import config
 from config import SHOPIFY_API_TOKEN, SHOPIFY_GRAPHQL_ENDPOINT
+from utils.state import load_state, save_state
+
+# Shopify locations whose committed stock is used; per-location columns are added when there is more than one
+SHOPIFY_LOCATION_IDS = getattr(config, "SHOPIFY_LOCATION_IDS", ["gid://shopify/Location/71392264438"])
+
+# Bulk operation results are streamed to disk here before they are parsed
+BULK_DOWNLOAD_DIR = 'cache/bulk'
+
+# Shopify keeps bulk operation result URLs valid for a week after completion
+BULK_RESULT_URL_LIFETIME = timedelta(days=7)
+
+# Client-side view of Shopify's GraphQL cost bucket, refreshed from extensions.cost on every response
+_throttle_status = {}
+_query_costs = {}
+_throttle_lock = threading.Lock()
+_shopify_session = requests.Session()
+
+# Bulk operations started by this app, keyed by query, are tracked in state/shopify_bulk_operations.json
+BULK_OPERATIONS_STATE = "shopify_bulk_operations"
+# Tracked operations are dropped once they failed or were last seen longer ago than this
+BULK_OPERATION_TRACKING_LIFETIME = timedelta(days=1)
+_bulk_operations_state_lock = threading.Lock()
+
+# Events set by the bulk_operations/finish webhook to wake the fetch waiting on an operation
+_bulk_operation_events = {}
+_bulk_operation_events_lock = threading.Lock()
 
 
 def start_bulk_operation(inner_query):
@@ -16,6 +51,7 @@ def start_bulk_operation(inner_query):
         bulkOperation {{
           id
           status
+          createdAt
         }}
         userErrors {{
           field
@@ -41,11 +77,114 @@ def start_bulk_operation(inner_query):
         print(response.text)
         return None
 
-def check_bulk_operation_status():
-    """Check the status of the current Shopify bulk operation."""
+def _wait_for_query_cost(cost):
+    """Sleep until the projected cost bucket can pay for a query of the given cost."""
+    with _throttle_lock:
+        if not _throttle_status:
+            return
+        elapsed = time.monotonic() - _throttle_status["updated_at"]
+        available = min(_throttle_status["maximum_available"],
+                        _throttle_status["currently_available"] + elapsed * _throttle_status["restore_rate"])
+        wait_time = (cost - available) / _throttle_status["restore_rate"]
+    if wait_time > 0:
+        print(f"Waiting {wait_time:.1f} seconds for Shopify query cost budget...")
+        time.sleep(wait_time)
+
+def _update_throttle_status(query, cost):
+    """Record the bucket state and query cost reported in a response's extensions.cost."""
+    throttle_status = cost.get("throttleStatus") or {}
+    with _throttle_lock:
+        if throttle_status:
+            _throttle_status.update({
+                "maximum_available": throttle_status["maximumAvailable"],
+                "currently_available": throttle_status["currentlyAvailable"],
+                "restore_rate": throttle_status["restoreRate"],
+                "updated_at": time.monotonic(),
+            })
+        if cost.get("requestedQueryCost"):
+            _query_costs[query] = cost["requestedQueryCost"]
+
+def execute_shopify_graphql_query(query, variables=None, max_retries=5):
+    """
+    Execute a Shopify GraphQL query, pacing requests by the cost budget Shopify reports in
+    extensions.cost.throttleStatus and retrying THROTTLED responses once the budget has refilled.
+    """
+    headers = {
+        "X-Shopify-Access-Token": SHOPIFY_API_TOKEN,
+        "Content-Type": "application/json"
+    }
+
+    for attempt in range(max_retries + 1):
+        _wait_for_query_cost(_query_costs.get(query, 0))
+        response = _shopify_session.post(SHOPIFY_GRAPHQL_ENDPOINT, json={"query": query, "variables": variables}, headers=headers, timeout=(5, 60))
+        if response.status_code != 200:
+            print("Failed to execute Shopify GraphQL query")
+            print(response.text)
+            response.raise_for_status()
+
+        result = response.json()
+        cost = (result.get("extensions") or {}).get("cost") or {}
+        _update_throttle_status(query, cost)
+
+        throttled = any((error.get("extensions") or {}).get("code") == "THROTTLED" for error in result.get("errors") or [])
+        if throttled and attempt < max_retries:
+            print("Shopify query throttled. Retrying when the cost budget allows...")
+            _wait_for_query_cost(cost.get("requestedQueryCost") or _query_costs.get(query, 0))
+            continue
+        if result.get("errors"):
+            print(f"Shopify GraphQL errors: {result['errors']}")
+        return result
+
+def fetch_shopify_paginated_data(query, variables, connection_path):
+    """
+    Fetch every node of a cursor-paginated Shopify connection.
+    Args:
+      connection_path (list): Keys leading from "data" to the connection, e.g. ["orders"].
+    Returns:
+      list: The connection's nodes.
+    """
+    nodes = []
+    variables = dict(variables, after=None)
+
+    while True:
+        result = execute_shopify_graphql_query(query, variables)
+        connection = result.get("data")
+        for key in connection_path:
+            connection = (connection or {}).get(key)
+        if connection is None:
+            raise Exception(f"Failed to fetch {'.'.join(connection_path)} from Shopify: {result.get('errors')}")
+
+        nodes.extend(edge["node"] for edge in connection["edges"])
+        page_info = connection["pageInfo"]
+        if not page_info["hasNextPage"]:
+            return nodes
+        variables["after"] = page_info["endCursor"]
+
+def fetch_shopify_orders_count(search_query, limit=10000):
+    """Return the number of orders matching a search query, or None if Shopify cannot count them."""
     query = """
-    {
-      currentBulkOperation {
+    query ($query: String, $limit: Int) {
+      ordersCount(query: $query, limit: $limit) {
+        count
+        precision
+      }
+    }
+    """
+    try:
+        result = execute_shopify_graphql_query(query, {"query": search_query, "limit": limit})
+    except requests.exceptions.RequestException as e:
+        print(f"Failed to count Shopify orders: {e}")
+        return None
+    orders_count = (result.get("data") or {}).get("ordersCount")
+    return orders_count["count"] if orders_count else None
+
+def check_bulk_operation_status(bulk_operation_id=None):
+    """
+    Check the status of a Shopify bulk operation.
+    With a bulk_operation_id the operation is looked up by ID (returned under data.node);
+    otherwise the shop's current bulk operation is returned (under data.currentBulkOperation).
+    """
+    fields = """
         id
         status
         errorCode
@@ -54,9 +193,25 @@ def check_bulk_operation_status():
         objectCount
         fileSize
         url
-      }
-    }
     """
+    if bulk_operation_id:
+        query = f"""
+        {{
+          node(id: "{bulk_operation_id}") {{
+            ... on BulkOperation {{
+              {fields}
+            }}
+          }}
+        }}
+        """
+    else:
+        query = f"""
+        {{
+          currentBulkOperation {{
+            {fields}
+          }}
+        }}
+        """
     
     headers = {
         "X-Shopify-Access-Token": SHOPIFY_API_TOKEN,
@@ -73,43 +228,362 @@ def check_bulk_operation_status():
         print(response.text)
         return None
 
-def download_bulk_operation_results(url):
-    """Download the results of a completed Shopify bulk operation."""
-    response = requests.get(url)
-    
-    if response.status_code == 200:
-        data = response.text.splitlines()
-        return [json.loads(line) for line in data]
-    else:
-        print("Failed to download bulk operation results")
-        print(response.text)
+def download_bulk_operation_file(url, path, chunk_size=1024 * 1024, max_retries=3):
+    """
+    Stream the results of a completed Shopify bulk operation to disk.
+    Data is written in chunks to a .part file; if the connection drops, the download resumes from
+    the bytes already on disk with an HTTP Range request. Returns the path, or None on failure.
+    """
+    if os.path.exists(path):
+        return path
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial_path = f"{path}.part"
+
+    for attempt in range(max_retries + 1):
+        offset = os.path.getsize(partial_path) if os.path.exists(partial_path) else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        try:
+            with requests.get(url, headers=headers, stream=True, timeout=(5, 300)) as response:
+                if offset and response.status_code == 416:
+                    # Nothing left to download
+                    break
+                if response.status_code not in (200, 206):
+                    print("Failed to download bulk operation results")
+                    print(response.text)
+                    return None
+                # A 200 answer to a ranged request is the whole file again
+                mode = 'ab' if response.status_code == 206 else 'wb'
+                with open(partial_path, mode) as file:
+                    for chunk in response.iter_content(chunk_size=chunk_size):
+                        file.write(chunk)
+            break
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+            if attempt == max_retries:
+                raise
+            print(f"Bulk operation download interrupted ({e}). Resuming...")
+
+    os.replace(partial_path, path)
+    return path
+
+def iter_bulk_operation_results(path):
+    """Iterate over the JSONL records of a downloaded bulk operation file one line at a time."""
+    with open(path, 'rb') as file:
+        for line in file:
+            if line.strip():
+                yield orjson.loads(line)
+
+def parse_bulk_orders(records):
+    """
+    Parse flat bulk operation order records into typed columnar tables in a single pass.
+    Line items (records with __parentId) are joined to their order through a hash map as they are
+    read; Shopify writes parents before their children, so no merge is needed afterwards.
+    Returns:
+      tuple: (orders_df, line_items_df). line_items_df carries the order's created_at.
+    """
+    orders = {"order_id": [], "order_number": [], "created_at": [], "order_tags": [],
+              "fulfillment_status": [], "financial_status": [], "cancelled_at": []}
+    line_items = {"line_item_id": [], "order_id": [], "sku": [], "variant_title": [],
+                  "quantity": [], "unfulfilled_quantity": [], "created_at": []}
+    order_created_at = {}
+
+    for record in records:
+        parent_id = record.get("__parentId")
+        if parent_id is None:
+            order_created_at[record["id"]] = record.get("createdAt")
+            orders["order_id"].append(record["id"])
+            orders["order_number"].append(record.get("name"))
+            orders["created_at"].append(record.get("createdAt"))
+            orders["order_tags"].append(", ".join(record.get("tags") or []))
+            orders["fulfillment_status"].append(record.get("displayFulfillmentStatus"))
+            orders["financial_status"].append(record.get("displayFinancialStatus"))
+            orders["cancelled_at"].append(record.get("cancelledAt"))
+        elif parent_id in order_created_at:
+            line_items["line_item_id"].append(record["id"])
+            line_items["order_id"].append(parent_id)
+            line_items["sku"].append(record.get("sku"))
+            line_items["variant_title"].append(record.get("variantTitle"))
+            line_items["quantity"].append(record.get("quantity") or 0)
+            line_items["unfulfilled_quantity"].append(record.get("unfulfilledQuantity") or 0)
+            line_items["created_at"].append(order_created_at[parent_id])
+
+    # Explicit object columns, so an empty result has the same column types as a full one
+    orders_df = pd.DataFrame(orders, dtype=object)
+    orders_df["created_at"] = pd.to_datetime(orders_df["created_at"], utc=True)
+    orders_df["cancelled_at"] = pd.to_datetime(orders_df["cancelled_at"], utc=True)
+
+    line_items_df = pd.DataFrame(line_items, dtype=object)
+    line_items_df["quantity"] = line_items_df["quantity"].astype("int64")
+    line_items_df["unfulfilled_quantity"] = line_items_df["unfulfilled_quantity"].astype("int64")
+    line_items_df["created_at"] = pd.to_datetime(line_items_df["created_at"], utc=True)
+
+    return orders_df, line_items_df
+
+def parse_bulk_inventory(records):
+    """
+    Parse flat bulk operation product/variant/inventory level records into a typed inventory levels
+    table in a single pass, joining each inventory level to its variant's SKU through a hash map.
+    Returns:
+      pandas.DataFrame: One row per variant and location with sku, variant_id, location_id,
+      location_name and the available, incoming, committed and on_hand quantities.
+    """
+    quantity_names = ("available", "incoming", "committed", "on_hand")
+    levels = {"sku": [], "variant_id": [], "location_id": [], "location_name": []}
+    levels.update({name: [] for name in quantity_names})
+    variant_skus = {}
+
+    for record in records:
+        if "quantities" in record:
+            variant_id = record.get("__parentId")
+            if variant_id not in variant_skus:
+                continue
+            quantities = {quantity["name"]: quantity["quantity"] for quantity in record["quantities"]}
+            levels["sku"].append(variant_skus[variant_id])
+            levels["variant_id"].append(variant_id)
+            levels["location_id"].append(record["location"]["id"])
+            levels["location_name"].append(record["location"].get("name"))
+            for name in quantity_names:
+                levels[name].append(quantities.get(name) or 0)
+        elif "sku" in record:
+            variant_skus[record["id"]] = record["sku"]
+
+    levels_df = pd.DataFrame(levels, dtype=object)
+    for name in quantity_names:
+        levels_df[name] = levels_df[name].astype("int64")
+    return levels_df
+
+def bulk_operation_file_path(bulk_operation_id):
+    """Return the download path for a bulk operation, e.g. gid://shopify/BulkOperation/123 -> cache/bulk/123.jsonl."""
+    return os.path.join(BULK_DOWNLOAD_DIR, f"{bulk_operation_id.rsplit('/', 1)[-1]}.jsonl")
+
+def prune_bulk_operation_files(max_age=24 * 60 * 60):
+    """Remove downloaded bulk operation files older than max_age seconds."""
+    if not os.path.isdir(BULK_DOWNLOAD_DIR):
+        return
+    cutoff = time.time() - max_age
+    for name in os.listdir(BULK_DOWNLOAD_DIR):
+        path = os.path.join(BULK_DOWNLOAD_DIR, name)
+        if os.path.getmtime(path) < cutoff:
+            os.remove(path)
+
+def bulk_operation_key(inner_query):
+    """Identify a bulk query independently of its whitespace."""
+    return hashlib.sha256(re.sub(r"\s+", " ", inner_query).strip().encode()).hexdigest()
+
+def get_bulk_operation(bulk_operation_id):
+    """Return a bulk operation by ID, or None if it cannot be looked up."""
+    status_result = check_bulk_operation_status(bulk_operation_id)
+    if not status_result:
         return None
+    return (status_result.get("data") or {}).get("node")
+
+def get_tracked_bulk_operation(key):
+    """Return the bulk operation recorded for a query key, or None."""
+    with _bulk_operations_state_lock:
+        return load_state(BULK_OPERATIONS_STATE, {}).get(key)
+
+def track_bulk_operation(key, bulk_operation):
+    """
+    Record the latest known state of the bulk operation started for a query key.
+    Entries that can no longer be attached to or reused are pruned on every write, so query keys
+    used once (e.g. sales deltas, whose search query contains a timestamp) do not pile up.
+    """
+    now = datetime.now(timezone.utc)
+    with _bulk_operations_state_lock:
+        operations = {
+            tracked_key: operation for tracked_key, operation in load_state(BULK_OPERATIONS_STATE, {}).items()
+            if is_tracked_bulk_operation_current(operation, now)
+        }
+        operations[key] = {
+            "id": bulk_operation["id"],
+            "status": bulk_operation.get("status"),
+            "completedAt": bulk_operation.get("completedAt"),
+            "trackedAt": now.isoformat(),
+        }
+        save_state(BULK_OPERATIONS_STATE, operations)
+
+def is_tracked_bulk_operation_current(operation, now):
+    """Whether a tracked operation may still be attached to or reused (not failed, seen recently)."""
+    if operation.get("status") not in ("CREATED", "RUNNING", "COMPLETED") or not operation.get("trackedAt"):
+        return False
+    return now - datetime.fromisoformat(operation["trackedAt"]) <= BULK_OPERATION_TRACKING_LIFETIME
+
+def find_reusable_bulk_operation(key, max_result_age):
+    """
+    Look up the operation previously started for this query.
+    Returns it if it is still running (so the caller can attach to it) or if it completed within
+    max_result_age and its result URL has not expired; otherwise returns None.
+    """
+    tracked = get_tracked_bulk_operation(key)
+    if not tracked:
+        return None
+
+    bulk_operation = get_bulk_operation(tracked["id"])
+    if not bulk_operation:
+        return None
+
+    status = bulk_operation.get("status")
+    if status in ("CREATED", "RUNNING"):
+        print(f"Attaching to in-flight bulk operation {bulk_operation['id']}")
+        return bulk_operation
+    if status == "COMPLETED" and bulk_operation.get("completedAt"):
+        age = datetime.now(timezone.utc) - datetime.fromisoformat(bulk_operation["completedAt"])
+        if age <= min(max_result_age, BULK_RESULT_URL_LIFETIME):
+            print(f"Reusing bulk operation {bulk_operation['id']} completed {int(age.total_seconds())} seconds ago")
+            return bulk_operation
+    return None
+
+def _bulk_operation_event(bulk_operation_id):
+    with _bulk_operation_events_lock:
+        return _bulk_operation_events.setdefault(bulk_operation_id, threading.Event())
+
+def notify_bulk_operation_finished(bulk_operation_id):
+    """
+    Wake the fetch waiting on a bulk operation, e.g. from the bulk_operations/finish webhook.
+    Operations nobody is waiting on are ignored, so no event is left behind for them.
+    """
+    with _bulk_operation_events_lock:
+        event = _bulk_operation_events.get(bulk_operation_id)
+    if event:
+        event.set()
+
+def verify_shopify_webhook(data, hmac_header):
+    """Verify a Shopify webhook signature. Always fails when SHOPIFY_WEBHOOK_SECRET is not configured."""
+    secret = getattr(config, "SHOPIFY_WEBHOOK_SECRET", None)
+    if not secret:
+        print("SHOPIFY_WEBHOOK_SECRET is not configured; rejecting Shopify webhook")
+        return False
+    digest = hmac.new(secret.encode(), data, hashlib.sha256).digest()
+    return hmac.compare_digest(base64.b64encode(digest).decode(), hmac_header or "")
+
+def register_bulk_operation_finish_webhook(callback_url):
+    """Subscribe callback_url to Shopify's bulk_operations/finish webhook."""
+    mutation = """
+    mutation ($callbackUrl: URL!) {
+      webhookSubscriptionCreate(topic: BULK_OPERATIONS_FINISH, webhookSubscription: {callbackUrl: $callbackUrl, format: JSON}) {
+        webhookSubscription {
+          id
+        }
+        userErrors {
+          field
+          message
+        }
+      }
+    }
+    """
+    
+    headers = {
+        "X-Shopify-Access-Token": SHOPIFY_API_TOKEN,
+        "Content-Type": "application/json"
+    }
+    
+    response = requests.post(SHOPIFY_GRAPHQL_ENDPOINT, json={"query": mutation, "variables": {"callbackUrl": callback_url}}, headers=headers)
+    print(response.text)
+    response.raise_for_status()
+    return response.json()
+
+def wait_for_bulk_operation(bulk_operation, min_interval=1, max_interval=30):
+    """
+    Poll a bulk operation until it finishes and return its final state (None if it cannot be found).
+    The poll interval starts at min_interval and backs off to max_interval: gently while objectCount
+    keeps growing, faster while it stalls. A bulk_operations/finish webhook for the operation ends
+    the wait immediately.
+    """
+    operation_id = bulk_operation["id"]
+    interval = min_interval
+    last_progress = None
+    event = _bulk_operation_event(operation_id)
+
+    try:
+        while True:
+            status = bulk_operation.get("status")
+            if status not in ("CREATED", "RUNNING", "CANCELING"):
+                return bulk_operation
+
+            progress = (status, int(bulk_operation.get("objectCount") or 0))
+            progressed = progress != last_progress
+            if progressed:
+                print(f"Bulk operation status: {progress[0]} ({progress[1]} objects)")
+            last_progress = progress
+
+            if event.wait(interval):
+                print("Bulk operation finish notification received")
+                event.clear()
+            interval = min(max_interval, interval * (1.5 if progressed else 2))
+
+            bulk_operation = get_bulk_operation(operation_id)
+            if not bulk_operation:
+                return None
+    finally:
+        with _bulk_operation_events_lock:
+            _bulk_operation_events.pop(operation_id, None)
+
+def submit_bulk_operation(inner_query, max_result_age=timedelta(minutes=15)):
+    """
+    Start a bulk operation for the query, or find one to attach to or reuse.
+    Returns (key, bulk_operation), or None if no operation could be started.
+    """
+    key = bulk_operation_key(inner_query)
+    bulk_operation = find_reusable_bulk_operation(key, max_result_age)
+    if bulk_operation:
+        return key, bulk_operation
 
-def fetch_shopify_bulk_operation(inner_query):
-    """Execute a Shopify bulk operation and return the results."""
     start_result = start_bulk_operation(inner_query)
     if not start_result:
         return None
-    
-    while True:
-        status_result = check_bulk_operation_status()
-        if not status_result:
-            return None
-        
-        bulk_operation = status_result.get("data", {}).get("currentBulkOperation")
-        if not bulk_operation:
-            print("No current bulk operation found")
-            return None
-        
-        status = bulk_operation.get("status")
-        
-        if status == "COMPLETED":
-            print("Bulk operation completed")
-            url = bulk_operation.get("url")
-            return download_bulk_operation_results(url)
-        elif status == "FAILED":
-            print("Bulk operation failed")
+
+    run_query = (start_result.get("data") or {}).get("bulkOperationRunQuery") or {}
+    if run_query.get("userErrors"):
+        print(f"Failed to start bulk operation: {run_query['userErrors']}")
+        return None
+    bulk_operation = run_query.get("bulkOperation")
+    if not bulk_operation:
+        print("No bulk operation was started")
+        return None
+    track_bulk_operation(key, bulk_operation)
+    return key, bulk_operation
+
+def collect_bulk_operation(key, bulk_operation, stream=False):
+    """Wait for a submitted bulk operation to finish and return its results."""
+    operation_id = bulk_operation["id"]
+    bulk_operation = wait_for_bulk_operation(bulk_operation)
+    # A missing or expired operation comes back as null or as a node without a status
+    if not bulk_operation or not bulk_operation.get("status"):
+        print(f"Bulk operation {operation_id} not found")
+        return None
+
+    status = bulk_operation.get("status")
+    track_bulk_operation(key, bulk_operation)
+
+    if status == "COMPLETED":
+        print(f"Bulk operation {operation_id} completed")
+        url = bulk_operation.get("url")
+        if not url:
+            # Operations that match no objects have no results file
+            return iter([]) if stream else []
+        path = download_bulk_operation_file(url, bulk_operation_file_path(operation_id))
+        if not path:
             return None
-        else:
-            print(f"Bulk operation status: {status}")
-            time.sleep(3)
+        prune_bulk_operation_files()
+        results = iter_bulk_operation_results(path)
+        return results if stream else list(results)
+    else:
+        print(f"Bulk operation {operation_id} {status.lower()}: {bulk_operation.get('errorCode')}")
+        return None
+
+def fetch_shopify_bulk_operation(inner_query, stream=False, max_result_age=timedelta(minutes=15)):
+    """
+    Execute a Shopify bulk operation and return the results.
+    Operations are tracked by ID per query. If the operation last started for the same query is
+    still running (e.g. after a crash or from an overlapping run) the fetch attaches to it, and a
+    result that completed within max_result_age is reused instead of exporting again.
+    Callers that advance a sync watermark should use the operation's createdAt rather than the
+    time of the call (see submit_bulk_operation and collect_bulk_operation).
+    The results file is downloaded to disk; with stream=True an iterator over its records is
+    returned instead of a list, so callers can process it with bounded memory.
+    """
+    submitted = submit_bulk_operation(inner_query, max_result_age)
+    if not submitted:
+        return None
+    key, bulk_operation = submitted
+    return collect_bulk_operation(key, bulk_operation, stream)
@@ -0,0 +1,43 @@
+import os
+import json
+import tempfile
+
+
+STATE_DIR = "state"
+
+
+def atomic_write(path, data, mode="w"):
+    """Write data to path via a temporary file and rename, so readers never see a partial file."""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=os.path.basename(path))
+    try:
+        with os.fdopen(fd, mode) as file:
+            file.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def state_path(name):
+    """Return the path of a named state file."""
+    return os.path.join(STATE_DIR, f"{name}.json")
+
+
+def load_state(name, default=None):
+    """Load a named JSON state file, returning default if it does not exist or is unreadable."""
+    path = state_path(name)
+    if not os.path.exists(path):
+        return default
+    try:
+        with open(path, "r") as file:
+            return json.load(file)
+    except (OSError, ValueError) as e:
+        print(f"Failed to read state file {path}: {e}")
+        return default
+
+
+def save_state(name, data):
+    """Atomically persist a named JSON state file."""
+    atomic_write(state_path(name), json.dumps(data, indent=2))
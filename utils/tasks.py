@@ -0,0 +1,33 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+def run_task_graph(tasks, max_workers=None):
+    """
+    Run a dependency graph of tasks on a thread pool. tasks maps each name to (function, dependencies);
+    a task is started as soon as all of its dependencies have finished and is called with their
+    results in order. The first task to raise stops any further tasks from starting and re-raises.
+    Returns:
+      dict: Each task's result by name.
+    """
+    results = {}
+    pending = dict(tasks)
+    running = {}
+    started_at = time.monotonic()
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(tasks)) as executor:
+        while pending or running:
+            for name, (function, dependencies) in list(pending.items()):
+                if all(dependency in results for dependency in dependencies):
+                    running[executor.submit(function, *[results[dependency] for dependency in dependencies])] = name
+                    del pending[name]
+            if not running:
+                raise ValueError(f"Tasks with unknown or circular dependencies: {sorted(pending)}")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                results[name] = future.result()
+                print(f"Task {name} finished after {time.monotonic() - started_at:.1f}s")
+
+    return results
@@ -1,24 +1,26 @@
 # prepare_replenishment.py
-from fetch import fetch_shiphero_stock_levels, fetch_airtable_incoming_stock, fetch_shopify_sales_data, fetch_airtable_product_metadata, fetch_shopify_inventory_data
+from utils import run_task_graph
+from fetch import fetch_shiphero_stock_levels, fetch_airtable_incoming_stock, fetch_shopify_sales_data, fetch_shopify_committed_inventory, fetch_airtable_product_metadata
 from transform import transform_stock_levels, transform_sales_data, transform_product_metadata, prepare_merged_replenishment_df
 from export import export_sheets_replenishment
 
-def prepare_replenishment(use_cache_stock_levels=False, use_cache_sales=False):
-    
-    # Prepare stock levels
-    stock_levels_data = fetch_shiphero_stock_levels(use_cache=use_cache_stock_levels)
-    incoming_stock_data = fetch_airtable_incoming_stock()
-    committed_stock_data = fetch_shopify_inventory_data()
-    stock_levels_df = transform_stock_levels(stock_levels_data, incoming_stock_data, committed_stock_data)
+def prepare_replenishment(use_cache_stock_levels=False, use_cache_sales=True, stock_levels_mode="paginated", cache_policy=None):
 
-    # Prepare sales and product metadata
-    sales_data = fetch_shopify_sales_data(use_cache=use_cache_sales)
-    sales_df = transform_sales_data(sales_data)
+    # The five sources are fetched concurrently and each transform starts as soon as its inputs are ready,
+    # so the fetch stage takes about as long as the slowest source
+    results = run_task_graph({
+        "stock_levels_data": (lambda: fetch_shiphero_stock_levels(use_cache=use_cache_stock_levels, mode=stock_levels_mode, cache_policy=cache_policy), []),
+        "incoming_stock_data": (lambda: fetch_airtable_incoming_stock(cache_policy=cache_policy), []),
+        "committed_stock_data": (lambda: fetch_shopify_committed_inventory(cache_policy=cache_policy), []),
+        "sales_data": (lambda: fetch_shopify_sales_data(use_cache=use_cache_sales, cache_policy=cache_policy), []),
+        "product_metadata": (lambda: fetch_airtable_product_metadata(cache_policy=cache_policy), []),
 
-    # Prepare product metadata
-    product_metadata = fetch_airtable_product_metadata()
-    product_metadata_df = transform_product_metadata(product_metadata)
+        # Prepare stock levels, sales data and product metadata
+        "stock_levels_df": (transform_stock_levels, ["stock_levels_data", "incoming_stock_data", "committed_stock_data"]),
+        "sales_df": (transform_sales_data, ["sales_data"]),
+        "product_metadata_df": (transform_product_metadata, ["product_metadata"]),
+    })
 
     # Prepare merged replenishment DataFrame and export to Google Sheets
-    replenishment_df = prepare_merged_replenishment_df(stock_levels_df, sales_df, product_metadata_df)
+    replenishment_df = prepare_merged_replenishment_df(results["stock_levels_df"], results["sales_df"], results["product_metadata_df"])
     export_sheets_replenishment(replenishment_df)
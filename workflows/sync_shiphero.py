@@ -3,6 +3,7 @@ from pyairtable import Table
 import config
 import json
 from fetch import fetch_purchase_orders_from_shiphero
+from utils import execute_shiphero_graphql_query
 
 
 def prepare_graphql_query_to_create_purchase_orders(po_record):
@@ -68,22 +69,6 @@ def prepare_graphql_query_to_create_purchase_orders(po_record):
     return query
 
 
-def execute_shiphero_graphql_query(query):
-    """Execute the GraphQL query and return the response."""
-    url = "https://public-api.shiphero.com/graphql"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {config.SHIPHERO_API_TOKEN}"
-    }
-    print("Executing GraphQL query:")
-    print(query)
-    response = requests.post(url, json=query, headers=headers)
-    print("Response status code:", response.status_code)
-    print("Response content:", response.content)
-    response.raise_for_status()
-    return response.json()
-
-
 def sync_shiphero_to_airtable(purchase_orders_table, line_items_table, airtable_po_record, shiphero_po):
     """Update Airtable with ShipHero Purchase Order data."""
     airtable_po_id = airtable_po_record['id']